@@ -0,0 +1,83 @@
+# Compares the time to turn a 10k-row upload into models: the former row by row conversion (iterrows, per-row
+# NA handling and validation, element-wise set_types, per-type set_doc_types) against the current vectorized one,
+# and checks that both give the same models.
+# Run from the project root: python -m benchmarks.bench_datafiles
+
+import asyncio
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from components.datafiles import IncomeDocsDF, RunsDFWeight
+
+ROWS = 10000
+
+
+def runs_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "ИД Рейса": range(1, ROWS + 1),
+        "Вес_погрузка": [24.5 if i % 7 else None for i in range(ROWS)],
+        "Вес_выгрузка": [24.1] * ROWS,
+        "Дата отправления": [datetime(2024, 2, 20)] * ROWS,
+        "Дата прибытия": [datetime(2024, 2, 21) if i % 5 else None for i in range(ROWS)],
+    })
+
+
+def documents_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "ИД Рейса": range(1, ROWS + 1),
+        "ПЛ": [f"ПЛ-{i}" for i in range(ROWS)],
+        "ТН": [float(i) for i in range(ROWS)],
+        "Реестр Перевозчика": [f"Р-{i}" for i in range(ROWS)],
+        "УПД Перевозчика": [f"УПД-{i % 100}" for i in range(ROWS)],
+    })
+
+
+def former_models(model_class, df: pd.DataFrame) -> list:
+    return [model_class(**row.replace("nan", pd.NA).dropna().to_dict()) for _, row in df.iterrows()]
+
+
+def former_set_types(df: pd.DataFrame) -> pd.DataFrame:
+    df_copy = df.drop(['run_id'], axis=1).astype(str).map(lambda x: x.replace('.0', ''))
+    df_copy['run_id'] = df['run_id'].astype('int64')
+    return df_copy
+
+
+def former_set_doc_types(df: pd.DataFrame) -> pd.DataFrame:
+    for key, value in IncomeDocsDF.DOC_TYPES.items():
+        df.loc[df['doc_type'] == key, 'doc_type'] = value
+    return df
+
+
+async def convert(parser, former: bool) -> list:
+    if former:
+        parser.create_models_from_dataframe = former_models
+        parser.set_types, parser.set_doc_types = former_set_types, former_set_doc_types
+    return await parser.objects_list
+
+
+def documents_parser() -> IncomeDocsDF:
+    parser = IncomeDocsDF(None)
+    parser.raw_df = documents_frame()
+    return parser
+
+
+def timed(make_parser, former: bool):
+    start = time.perf_counter()
+    result = asyncio.run(convert(make_parser(), former))
+    return time.perf_counter() - start, result
+
+
+def main():
+    parsers = {"runs weight": lambda: RunsDFWeight(runs_frame()), "documents": documents_parser}
+    print(f"{'file':<14}{'rows':>8}{'row by row, ms':>16}{'vectorized, ms':>16}{'speedup':>10}")
+    for name, make_parser in parsers.items():
+        before, former_result = timed(make_parser, former=True)
+        after, result = timed(make_parser, former=False)
+        assert [m.model_dump() for m in former_result] == [m.model_dump() for m in result]
+        print(f"{name:<14}{len(result):>8}{before * 1000:>16.0f}{after * 1000:>16.0f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
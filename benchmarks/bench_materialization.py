@@ -0,0 +1,46 @@
+# Compares rows/second of building models from view rows: full validation from dict rows (the former
+# get_view_data path) against MyModel.from_rows on plain tuples (the current one).
+# Run from the project root: python -m benchmarks.bench_materialization
+
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from models.front_interaction import Car, Invoice, Run
+
+ROWS = 10000
+SAMPLE_ROWS = {
+    Run: (1, 18, 61, 5, date(2024, 2, 20), "ТН-15", "ПЛ-3", Decimal("24.5"), Decimal("24.1"), Decimal("24.5"),
+          Decimal("24.1"), date(2024, 2, 21), "R-1", date(2024, 2, 29), "A-1", date(2024, 2, 29), "ММК",
+          "Магнитогорск - Екатеринбург", "Руда"),
+    Invoice: (5, "ММК", "Магнитогорск - Екатеринбург", "Руда", Decimal("500.000"), Decimal("1200.00"),
+              datetime(2024, 2, 1), datetime(2024, 2, 29), "ММК", "УГМК", "Екатеринбург", "Магнитогорск",
+              "Договор 15"),
+    Car: (18, "MERCEDES-BENZ ACTROS 2645 LS", "О183ОМ196", "РВ-ТАРИФ", "WDB93406", Decimal("2015"),
+          Decimal("450"), Decimal("25000"), Decimal("30"), Decimal("9000"), "Тягач", "ACTROS",
+          "Полуприцеп ТОНАР"),
+}
+
+
+def rows_per_second(func, rows) -> float:
+    start = time.perf_counter()
+    func(rows)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def validated(cl):
+    fields = list(cl.__annotations__.keys())
+    return lambda rows: [cl(**dict(zip(fields, row))) for row in rows]
+
+
+def main():
+    print(f"{'model':<10}{'validated, rows/s':>20}{'from_rows, rows/s':>20}{'speedup':>10}")
+    for cl, sample in SAMPLE_ROWS.items():
+        rows = [sample] * ROWS
+        before = rows_per_second(validated(cl), rows)
+        after = rows_per_second(cl.from_rows, rows)
+        print(f"{cl.__name__:<10}{before:>20,.0f}{after:>20,.0f}{after / before:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
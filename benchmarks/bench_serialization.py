@@ -0,0 +1,48 @@
+# Compares the encode time per 1k rows of a list response: the response_model validation, jsonable_encoder and
+# json.dumps of FastAPI's default path against FastJSONResponse (orjson) on the same models, and checks that
+# both produce the same JSON.
+# Run from the project root: python -m benchmarks.bench_serialization
+
+import asyncio
+import json
+import time
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from benchmarks.bench_materialization import SAMPLE_ROWS
+from components.responses import FastJSONResponse
+
+ROWS = 10000
+
+
+def ms_per_1k_rows(func, rows) -> float:
+    start = time.perf_counter()
+    func(rows)
+    return (time.perf_counter() - start) * 1000 / (len(rows) / 1000)
+
+
+def default_response(cl):
+    field = create_response_field(name=f"Response_{cl.__name__}", type_=List[cl], mode="serialization")
+
+    def encode(models):
+        content = asyncio.run(serialize_response(field=field, response_content=models, is_coroutine=True))
+        return JSONResponse(content).body
+    return encode
+
+
+def main():
+    print(f"{'model':<10}{'default, ms/1k':>16}{'orjson, ms/1k':>16}{'speedup':>10}")
+    for cl, sample in SAMPLE_ROWS.items():
+        models = cl.from_rows([sample] * ROWS)
+        encode = default_response(cl)
+        assert json.loads(encode(models[:10])) == json.loads(FastJSONResponse(models[:10]).body)
+        before = ms_per_1k_rows(encode, models)
+        after = ms_per_1k_rows(lambda _models: FastJSONResponse(_models).body, models)
+        print(f"{cl.__name__:<10}{before:>16.2f}{after:>16.2f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Compares the time to parse the same drivers_place upload from xlsx, csv and parquet into models, and checks
+# that all three give the same models.
+# Run from the project root: python -m benchmarks.bench_upload_formats
+
+import asyncio
+import io
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from components.datafiles import DriverPlacesDF
+
+ROWS = 20000
+
+
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Дата": [datetime(2024, 1, 1) + timedelta(days=i % 365) for i in range(ROWS)],
+        "ИД Водителя": [i % 300 + 1 for i in range(ROWS)],
+        "ИД Машины": [i % 200 + 1 for i in range(ROWS)],
+        "Комментарий": [f"строка {i}" for i in range(ROWS)],
+    })
+
+
+def files() -> dict:
+    df = frame()
+    xlsx, csv, parquet = io.BytesIO(), io.BytesIO(), io.BytesIO()
+    df.to_excel(xlsx, index=False)
+    df.assign(Дата=df["Дата"].dt.strftime("%d.%m.%Y")).to_csv(csv, index=False, sep=";")
+    df.to_parquet(parquet, index=False)
+    return {"xlsx": xlsx.getvalue(), "csv": csv.getvalue(), "parquet": parquet.getvalue()}
+
+
+def upload(file_format: str, content: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(content), size=len(content), filename=f"places.{file_format}",
+                      headers=Headers({"content-type": "application/octet-stream"}))
+
+
+def timed(file_format: str, content: bytes):
+    start = time.perf_counter()
+    result = asyncio.run(DriverPlacesDF(upload(file_format, content)).objects_list)
+    return time.perf_counter() - start, result
+
+
+def main():
+    print(f"{'format':<10}{'rows':>8}{'size, kB':>10}{'parse, ms':>12}{'vs xlsx':>10}")
+    baseline, expected = None, None
+    for file_format, content in files().items():
+        elapsed, result = timed(file_format, content)
+        if baseline is None:
+            baseline, expected = elapsed, [m.model_dump() for m in result]
+        assert [m.model_dump() for m in result] == expected
+        print(f"{file_format:<10}{len(result):>8}{len(content) / 1024:>10.0f}{elapsed * 1000:>12.0f}"
+              f"{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+
+class ViewCache:
+    """
+    Bounded in-process read-through cache of view query results.
+
+    Entries are keyed by (view, query key), evicted least recently used beyond `maxsize` and expire after `ttl`
+    seconds. invalidate() drops every entry of the given views; a result read before an invalidation of its view
+    is not stored after it, so a query racing with a sync never caches the old data.
+
+    The per-view generations also serve as change counters for ETags; the `versioned` views are not cached but
+    versioned as well, and invalidate() without views invalidates them too.
+    """
+
+    def __init__(self, views, maxsize: int = 256, ttl: float = 600, versioned=()):
+        self.views = frozenset(views)
+        # views that are not cached, only versioned for ETags
+        self.versioned = frozenset(versioned)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {view: 0 for view in self.views | self.versioned}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+        # generations restart from zero with the process, the nonce keeps the ETags of different runs apart
+        self._boot = uuid.uuid4().hex[:12]
+
+    def generation(self, view) -> int:
+        return self._generations.get(view, 0)
+
+    def etag(self, view, *variant) -> str:
+        """
+        Returns a weak ETag that changes with every invalidation of the view. The variant parts tell apart
+        the responses of one URL that depend on something else than the view, e.g. a default date.
+        """
+        return f'W/"{"-".join(map(str, (view, self._boot, self.generation(view), *variant)))}"'
+
+    def get(self, view, key):
+        """Returns (True, value) for a fresh entry, (False, None) otherwise."""
+        with self._lock:
+            entry = self._entries.get((view, key))
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end((view, key))
+                self._counters["hits"] += 1
+                return True, entry[1]
+            self._counters["misses"] += 1
+            return False, None
+
+    def set(self, view, key, value, generation: int):
+        with self._lock:
+            if self._generations.get(view, 0) != generation:
+                return
+            self._entries[(view, key)] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((view, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *views):
+        """Invalidates the given views, or every cached and versioned view."""
+        with self._lock:
+            views = views or tuple(self._generations)
+            for view in views:
+                self._generations[view] = self._generations.get(view, 0) + 1
+            self._entries = OrderedDict((k, v) for k, v in self._entries.items() if k[0] not in views)
+            self._counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "maxsize": self.maxsize, "ttl": self.ttl, **self._counters}
+
+
+class BytesCache:
+    """
+    Bounded in-process LRU cache of binary content keyed by a hash of what the content is generated from,
+    so entries never need invalidation: changed input gives a new key. The size is bounded by the total bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return content
+
+    def set(self, key: str, content: bytes):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = content
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                self._size -= len(self._entries.popitem(last=False)[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes,
+                    **self._counters}
@@ -1,19 +1,37 @@
+import math
+import zipfile
+from functools import cache
 from typing import List, Optional
 
+import openpyxl
 import pydantic
 from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from abc import ABC
 import pandas as pd
-import io
 
 from models.documents import Document
 from models.front_interaction import MyModel, DriverPlace, Run, RunUpdaterClientWeight, RunUpdaterWeight
 
 
+@cache
+def models_adapter(model_class) -> pydantic.TypeAdapter:
+    return pydantic.TypeAdapter(List[model_class])
+
+
 class FileXLSX(ABC):
-    MAX_FILE_SIZE: int = 1 * 1024 * 1024  # 1 MB
+    MAX_FILE_SIZE: int = 20 * 1024 * 1024  # 20 MB
+    # the columns sanityze_df needs, only they are read from the file
+    COLUMNS: tuple = ()
+    CONTENT_TYPES = {"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+                     "text/csv": "csv", "application/csv": "csv",
+                     "application/vnd.apache.parquet": "parquet", "application/x-parquet": "parquet"}
+    READERS = {"xlsx": "read_xlsx", "csv": "read_csv", "parquet": "read_parquet"}
+    # text files have no date type: the columns with this prefix are parsed as dates, day first (дд.мм.гггг)
+    DATE_PREFIX = "Дата"
 
     def __init__(self):
+        self.columns = self.COLUMNS
         self.raw_df = None
         self.__df = None
         self.__objects_list = None
@@ -24,9 +42,7 @@ class FileXLSX(ABC):
     @property
     async def df(self) -> pd.DataFrame:
         if self.__df is None:
-            if self.raw_df is None:
-                self.raw_df = await self.get_df(self.file)
-            self.__df = await self.sanityze_df(self.raw_df)
+            await run_in_threadpool(self.load_df)
         return self.__df
 
     # async def set_df(self, value: pd.DataFrame):
@@ -38,52 +54,170 @@ class FileXLSX(ABC):
 
     @property
     async def objects_list(self) -> List[MyModel]:
+        # reading, cleaning and validating a big file takes seconds, none of it runs on the event loop
         if self.__objects_list is None:
-            self.__objects_list = await self.create_models_from_dataframe(self.model, await self.df)
+            await run_in_threadpool(self.load_objects_list)
         return self.__objects_list
 
     # @objects_list.setter
     # async def objects_list(self, value: List[MyModel]):
     #     self.__df = value
 
-    async def sanityze_df(self, df: pd.DataFrame) -> pd.DataFrame:
+    def load_df(self) -> pd.DataFrame:
+        """Reads the file if raw_df is not set and cleans the frame. Blocking, run it in a thread pool."""
+        if self.__df is None:
+            if self.raw_df is None:
+                self.raw_df = self.read_df(self.file)
+            self.__df = self.sanityze_df(self.raw_df)
+        return self.__df
+
+    def load_objects_list(self) -> List[MyModel]:
+        """Blocking, run it in a thread pool."""
+        if self.__objects_list is None:
+            self.__objects_list = self.create_models_from_dataframe(self.model, self.load_df())
+        return self.__objects_list
+
+    def sanityze_df(self, df: pd.DataFrame) -> pd.DataFrame:
         raise NotImplementedError
 
-    async def create_models_from_dataframe(self, model_class, df: pd.DataFrame = None) -> List[MyModel]:
-        df = await self.df if df is None else df
-        result = []
+    @classmethod
+    def in_frame(cls, df: pd.DataFrame, key_columns: tuple = ("ИД Рейса",)) -> bool:
+        """Whether the frame has any of the columns of this file besides the key ones."""
+        return any(column in df.columns for column in cls.COLUMNS if column not in key_columns)
+
+    def create_models_from_dataframe(self, model_class, df: pd.DataFrame = None) -> List[MyModel]:
+        """
+        Validates the rows of the frame as models in one pass; empty cells (NA or "nan") are left out so that
+        the model defaults apply. A validation error lists every invalid row, by its position in the frame.
+        Blocking, run it in a thread pool.
+        """
+        df = self.load_df() if df is None else df
+        columns = list(df.columns)
+        present = (df.notna() & df.ne("nan")).to_numpy()
+        rows = [{column: value for column, value, keep in zip(columns, record.values(), mask) if keep}
+                for record, mask in zip(df.to_dict("records"), present)]
         try:
-            for _, row in df.iterrows():
-                row = row.replace("nan", pd.NA).dropna()
-                result.append(model_class(**row.to_dict()))
+            return models_adapter(model_class).validate_python(rows)
         except pydantic.ValidationError as e:
             raise HTTPException(status_code=400, detail=f"Ошибка в данных: {e}")
-        return result
 
-    @classmethod
-    async def check_xlsx_file(cls, file) -> bool:
-        if file.content_type != 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
-            raise HTTPException(status_code=400, detail="File must be in xlsx format")
-        elif file.size > cls.MAX_FILE_SIZE:
+    def check_file(self, file) -> str:
+        """Returns the format of the uploaded file: "xlsx", "csv" or "parquet"."""
+        file_format = self.file_format(file)
+        if file_format is None:
+            raise HTTPException(status_code=400, detail="File must be in xlsx, csv or parquet format")
+        elif file.size > self.MAX_FILE_SIZE:
             raise HTTPException(status_code=400, detail="File is too big")
         else:
-            return True
+            return file_format
+
+    @classmethod
+    def file_format(cls, file) -> Optional[str]:
+        # generated files are often sent as application/octet-stream, the file extension is checked then
+        if file.content_type in cls.CONTENT_TYPES:
+            return cls.CONTENT_TYPES[file.content_type]
+        extension = (file.filename or "").rpartition(".")[2].lower()
+        return extension if extension in cls.READERS else None
+
+    def read_df(self, file: UploadFile) -> pd.DataFrame:
+        """Blocking, run it in a thread pool."""
+        reader = getattr(self, self.READERS[self.check_file(file)])
+        return reader(file.file, self.columns)
+
+    @staticmethod
+    def read_xlsx(file, columns) -> pd.DataFrame:
+        """
+        Reads the columns of the first sheet found among the given ones, like pd.read_excel(usecols=...) with the
+        first row as header. The sheet is streamed in openpyxl read-only mode and only the values of these columns
+        are kept, so the memory used grows with the needed cells only. Rows without any of these values are skipped.
+        Blocking, run it in a thread pool.
+        """
+        try:
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            raise HTTPException(status_code=400, detail="File must be in xlsx format")
+        try:
+            sheet = workbook.worksheets[0]
+            # the dimensions stored by some writers are wrong, read up to the last row instead
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, ())
+            positions = {name: position for position, name in enumerate(header) if name in columns}
+            data = {name: [] for name in positions}
+            for row in rows:
+                values = [row[position] if position < len(row) else None for position in positions.values()]
+                if any(value is not None for value in values):
+                    for name, value in zip(positions, values):
+                        # empty cells are NaN, as read_excel gives them
+                        data[name].append(math.nan if value is None else value)
+            return pd.DataFrame(data)
+        finally:
+            workbook.close()
+
+    @classmethod
+    def read_csv(cls, file, columns) -> pd.DataFrame:
+        """
+        Reads the given columns of a CSV file with a header row (UTF-8, "," or ";" separated, "." in numbers) as text,
+        like read_xlsx reads a sheet: rows without any of these values are skipped, dates are parsed day first.
+        Blocking, run it in a thread pool.
+        """
+        try:
+            df = pd.read_csv(file, sep=cls.sniff_separator(file), usecols=lambda name: name in columns, dtype=str,
+                             keep_default_na=False, na_values=[""], encoding="utf-8-sig")
+        except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError):
+            raise HTTPException(status_code=400, detail="File must be in csv format")
+        return cls.parse_dates(df.dropna(how="all"))
+
+    @classmethod
+    def read_parquet(cls, file, columns) -> pd.DataFrame:
+        """
+        Reads the given columns of a Parquet file; rows without any of these values are skipped, dates stored
+        as text are parsed day first. Blocking, run it in a thread pool.
+        """
+        import pyarrow
+        import pyarrow.parquet as pq
+
+        try:
+            parquet = pq.ParquetFile(file)
+            names = [name for name in parquet.schema_arrow.names if name in columns]
+            df = parquet.read(columns=names).to_pandas()
+        except pyarrow.ArrowException:
+            raise HTTPException(status_code=400, detail="File must be in parquet format")
+        return cls.parse_dates(df.dropna(how="all"))
+
+    @staticmethod
+    def sniff_separator(file) -> str:
+        # spreadsheets in the Russian locale save CSV with ";"
+        header = file.readline()
+        file.seek(0)
+        if isinstance(header, bytes):
+            header = header.decode("utf-8", errors="ignore")
+        return ";" if header.count(";") > header.count(",") else ","
 
     @classmethod
-    async def get_df(cls, file: UploadFile) -> pd.DataFrame:
-        if await cls.check_xlsx_file(file):
-            content = await file.read()
-            return pd.read_excel(io.BytesIO(content), engine='openpyxl')
+    def parse_dates(cls, df: pd.DataFrame) -> pd.DataFrame:
+        for name in df.columns:
+            if name.startswith(cls.DATE_PREFIX) and not pd.api.types.is_datetime64_any_dtype(df[name]):
+                try:
+                    df[name] = pd.to_datetime(df[name], dayfirst=True)
+                except (ValueError, TypeError) as e:
+                    raise HTTPException(status_code=400, detail=f"Ошибка в данных (Дату указать в формате "
+                                                                f"дд.мм.гггг): {e}")
+        return df
 
 
 class DriverPlacesDF(FileXLSX, ABC):
+    COLUMNS = ("Дата", "ИД Водителя", "ИД Машины")
+
     def __init__(self, file: UploadFile, method: str = 'POST'):
         super().__init__()
         self.file = file
         self.model = DriverPlace
         self.method = method
+        if method == 'PUT':
+            self.columns += ("ИД",)
 
-    async def sanityze_df(self, df: pd.DataFrame):
+    def sanityze_df(self, df: pd.DataFrame):
         message = "Должны быть столбцы: Дата, ИД Водителя, ИД Машины"
         try:
             match self.method:
@@ -112,13 +246,16 @@ class DriverPlacesDF(FileXLSX, ABC):
 
 
 class RunsDF(FileXLSX, ABC):
+    COLUMNS = ("ИД Рейса", "Дата отправления", "ИД Машины", "ИД Заявки", "Вес_погрузка", "Дата прибытия",
+               "Вес_выгрузка", "ИД Водителя", "Вес_погрузка_клиент", "Вес_выгрузка_клиент")
+
     def __init__(self, file: UploadFile, method: str = 'POST'):
         super().__init__()
         self.file = file
         self.model = Run
         self.method = method
 
-    async def sanityze_df(self, df: pd.DataFrame):
+    def sanityze_df(self, df: pd.DataFrame):
         try:
             match self.method:
                 case 'POST':
@@ -157,12 +294,14 @@ class RunsDF(FileXLSX, ABC):
 
 
 class RunsDFClientWeight(FileXLSX, ABC):
+    COLUMNS = ("ИД Рейса", "Вес_погрузка_клиент", "Вес_выгрузка_клиент")
+
     def __init__(self, df: pd.DataFrame):
         super().__init__()
         self.raw_df = df
         self.model = RunUpdaterClientWeight
 
-    async def sanityze_df(self, df: pd.DataFrame):
+    def sanityze_df(self, df: pd.DataFrame):
         try:
             df = df.rename(columns={"ИД Рейса": "id", "Вес_погрузка_клиент": "client_weight",
                                     "Вес_выгрузка_клиент": "client_weight_arrival"}).dropna(subset=["id"], how="any")
@@ -176,12 +315,14 @@ class RunsDFClientWeight(FileXLSX, ABC):
 
 
 class RunsDFWeight(FileXLSX, ABC):
+    COLUMNS = ("ИД Рейса", "Вес_погрузка", "Вес_выгрузка", "Дата отправления", "Дата прибытия")
+
     def __init__(self, df: pd.DataFrame):
         super().__init__()
         self.raw_df = df
         self.model = RunUpdaterWeight
 
-    async def sanityze_df(self, df: pd.DataFrame):
+    def sanityze_df(self, df: pd.DataFrame):
         try:
             df = df.rename(columns={"ИД Рейса": "id", "Вес_погрузка": "weight",
                                     "Вес_выгрузка": "weight_arrival",
@@ -208,8 +349,8 @@ class DocumentsDF(FileXLSX, ABC):
 
     @classmethod
     def set_doc_types(cls, df: pd.DataFrame) -> pd.DataFrame:
-        for key, value in cls.DOC_TYPES.items():
-            df.loc[df['doc_type'] == key, 'doc_type'] = value
+        doc_types = df['doc_type'].map(cls.DOC_TYPES)
+        df['doc_type'] = doc_types.where(doc_types.notna(), df['doc_type'])
         return df
 
     @classmethod
@@ -224,13 +365,15 @@ class DocumentsDF(FileXLSX, ABC):
         df_copy = df.copy()
         df_copy = df_copy.drop(['run_id'], axis=1)
         df_copy = df_copy.astype(str)
-        df_copy = df_copy.map(lambda x: x.replace('.0', ''))
+        df_copy = df_copy.apply(lambda column: column.str.replace('.0', '', regex=False))
         df_copy['run_id'] = df['run_id'].astype('int64')
         return df_copy
 
 
 class IncomeDocsDF(DocumentsDF, FileXLSX, ABC):
-    async def sanityze_df(self, df: pd.DataFrame):
+    COLUMNS = ("ИД Рейса", "ПЛ", "ТН", "Реестр Перевозчика", "УПД Перевозчика")
+
+    def sanityze_df(self, df: pd.DataFrame):
         try:
             df = df.rename(columns={"ИД Рейса": "run_id"}).dropna(subset=["run_id"], how="any")
             df = df[["run_id", "ПЛ", "ТН", "Реестр Перевозчика", "УПД Перевозчика"]]
@@ -247,7 +390,9 @@ class IncomeDocsDF(DocumentsDF, FileXLSX, ABC):
 
 
 class ClientDocsDF(DocumentsDF, FileXLSX, ABC):
-    async def sanityze_df(self, df: pd.DataFrame):
+    COLUMNS = ("ИД Рейса", "УПД Поставщика", "Реестр Заказчику", "УПД Заказчику")
+
+    def sanityze_df(self, df: pd.DataFrame):
         try:
             df = df.rename(columns={"ИД Рейса": "run_id"}).dropna(subset=["run_id"], how="any")
             df = df[["run_id", "УПД Поставщика", "Реестр Заказчику", "УПД Заказчику"]]
@@ -1,15 +1,140 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import multiprocessing
 import os.path
+import queue
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
 
+import pdfrw
 from fastapi import HTTPException
-from fillpdf import fillpdfs
+from psycopg2 import sql
+
+from components.cache import BytesCache
+from database import sql_handler
 from models import documents as doc_model
-from routes import front_interaction as front
+from models.front_interaction import Run, Invoice, Car, Person
+
+
+class PdfTemplate:
+    """
+    Fillable PDF template, parsed at most MAX_COPIES times per file in a process.
+
+    Filling mutates the parsed objects, so a copy is filled by one thread at a time: render() borrows a copy of the
+    file, parsing another one while there are fewer than MAX_COPIES and waiting for one to be returned otherwise.
+    A parsed tn.pdf holds about 13 MB, a copy for each of the 40 threads of the request pool would hold half a GB.
+    Only text fields are filled, the same way fillpdf.write_fillable_pdf does; fields missing from the data get
+    back their template values.
+    """
+    MAX_COPIES = 2
+    _copies = {}
+    _parsed = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.pdf = pdfrw.PdfReader(path)
+        self.fields = {}
+        for page in self.pdf.pages:
+            for annotation in page["/Annots"] or ():
+                target = annotation if annotation["/T"] else annotation["/Parent"]
+                if not target or annotation["/Subtype"] != "/Widget" or target["/FT"] != "/Tx":
+                    continue
+                key = target["/T"][1:-1]
+                parent = target
+                while parent["/Parent"]:
+                    key = target["/Parent"]["/T"][1:-1] + "." + key
+                    parent = parent["/Parent"]
+                objects = [target, target["/Kids"][0]] if target["/Kids"] else [target]
+                self.fields.setdefault(key, []).extend((obj, obj["/V"], obj["/AP"]) for obj in objects)
+        self.pdf.Root.AcroForm.update(pdfrw.PdfDict(NeedAppearances=pdfrw.PdfObject("true")))
+
+    @classmethod
+    @contextlib.contextmanager
+    def borrow(cls, path: str):
+        with cls._lock:
+            copies = cls._copies.setdefault(path, queue.LifoQueue())
+            parse = copies.empty() and cls._parsed.get(path, 0) < cls.MAX_COPIES
+            if parse:
+                cls._parsed[path] = cls._parsed.get(path, 0) + 1
+        try:
+            template = cls(path) if parse else copies.get()
+        except BaseException:
+            if parse:
+                with cls._lock:
+                    cls._parsed[path] -= 1
+            raise
+        try:
+            yield template
+        finally:
+            copies.put(template)
+
+    @classmethod
+    def render(cls, path: str, data: dict) -> bytes:
+        """Fills a copy of the template file, see fill(); blocks while every copy is being filled."""
+        with cls.borrow(path) as template:
+            return template.fill(data)
+
+    def fill(self, data: dict) -> bytes:
+        """Returns the PDF with the text fields named by the data keys set to the str() of the values."""
+        for key, objects in self.fields.items():
+            for obj, value, appearance in objects:
+                if key in data:
+                    obj.update(pdfrw.PdfDict(V=str(data[key]), AP=str(data[key])))
+                else:
+                    # attribute assignment drops the keys the template did not have, update() would keep them
+                    obj.V, obj.AP = value, appearance
+        output = io.BytesIO()
+        pdfrw.PdfWriter().write(output, self.pdf)
+        return output.getvalue()
+
+
+@cache
+def _file_hash(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def template_version(path: str) -> str:
+    """Returns the hash of the template file content, computed again only when the file changes."""
+    stat = os.stat(path)
+    return _file_hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+def fill_template(template_file: str, data: dict) -> bytes:
+    """Fills the template in a process of PdfFile.executor()."""
+    return PdfTemplate.render(template_file, data)
+
+
+class _ZipOutput:
+    """Unseekable file collecting what zipfile writes until it is read."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
 
 
 class PdfFile:
-    DOC_TYPES = {"ПЛ": {'doc_type': 1, 'template_name': 'waybill.pdf', 'model': doc_model.Waybill},
-                 "ТН": {'doc_type': 2, 'template_name': 'tn.pdf', 'model': doc_model.TransportInvoice},
-                 "ТТН": {'doc_type': 3, 'template_name': 'ttn.pdf', 'model': doc_model.CargoInvoice},
+    DOC_TYPES = {"ПЛ": {'doc_type': 1, 'template_name': 'waybill.pdf', 'model': doc_model.Waybill,
+                        'name_column': 'waybill'},
+                 "ТН": {'doc_type': 2, 'template_name': 'tn.pdf', 'model': doc_model.TransportInvoice,
+                        'name_column': 'invoice_document'},
+                 "ТТН": {'doc_type': 3, 'template_name': 'ttn.pdf', 'model': doc_model.CargoInvoice,
+                         'name_column': 'invoice_document'},
                  "Реестр Заказчику": {'doc_type': 4, 'template_name': 'client_register.pdf', 'model': None},
                  "Реестр Перевозчика": {'doc_type': 6, 'template_name': 'carrier_register.pdf', 'model': None},
                  "УПД Заказчику": {'doc_type': 7, 'template_name': 'client_invoice.pdf', 'model': None},
@@ -18,6 +143,16 @@ class PdfFile:
                  }
     FIELDS = []
     DOC_TYPE_NAME = None
+    # views the document data is read from: (view, model, column of runs_view referencing the view's id);
+    # a field present in several views is taken from the last one
+    SOURCES = (("runs_view", Run, None), ("invoices", Invoice, "invoice_id"), ("cars", Car, "car_id"),
+               ("persons", Person, "driver_id"))
+    # batch generation: processes filling the templates and documents submitted ahead per process
+    MAX_WORKERS = min(4, os.cpu_count() or 1)
+    PENDING_PER_WORKER = 2
+    _executor = None
+    # filled documents by the hash of the template and the field values
+    CACHE = BytesCache(max_bytes=128 * 1024 * 1024)
 
     def __init__(self, run_id: int, doc_name: str):
         if self.DOC_TYPE_NAME not in self.DOC_TYPES:
@@ -25,52 +160,158 @@ class PdfFile:
         if not self.DOC_TYPES[self.DOC_TYPE_NAME]['model']:
             raise NotImplementedError("This document type is not implemented yet.")
         self.template_file = os.path.join("template_docs", self.DOC_TYPES[self.DOC_TYPE_NAME]['template_name'])
-        self.output_file = os.path.join("template_docs", f"{run_id}.pdf")
         self.doc = self.DOC_TYPES[self.DOC_TYPE_NAME]['model'](run_id=run_id, name=doc_name,
                                                                doc_type=self.DOC_TYPES[self.DOC_TYPE_NAME]['doc_type'])
         self.data = dict()
         self.content = None
 
-    async def add_run_data(self):
-        run_data = front.get_run(self.doc.run_id)
-        self.doc = self.doc.copy(update=(await run_data).dict())
-
-    async def add_invoice_data(self):
-        invoice_data = front.get_invoice(self.doc.invoice_id)
-        self.doc = self.doc.copy(update=(await invoice_data).dict())
-
-    async def add_car_data(self):
-        car_data = front.get_car(self.doc.car_id)
-        self.doc = self.doc.copy(update=(await car_data).dict())
-
-    async def add_driver_data(self):
-        driver_data = front.get_driver(self.doc.driver_id)
-        self.doc = self.doc.copy(update=(await driver_data).dict())
+    @classmethod
+    def data_query(cls, where=None) -> sql.Composed:
+        """
+        Returns the query of the run ID, the document name from the run and the document fields found in SOURCES
+        for the runs matching the where condition on the t0 (runs_view) alias, by default the run ID placeholder.
+        """
+        model = cls.DOC_TYPES[cls.DOC_TYPE_NAME]['model']
+        columns = {}
+        for number, (view, source_model, _) in enumerate(cls.SOURCES):
+            for field in source_model.model_fields:
+                if field in model.model_fields:
+                    columns[field] = number
+        select = sql.SQL("t0.id as run_id, {name} as doc_name").format(
+            name=sql.Identifier("t0", cls.DOC_TYPES[cls.DOC_TYPE_NAME]['name_column']))
+        for field, number in columns.items():
+            select += sql.SQL(", {column} as {field}").format(column=sql.Identifier(f"t{number}", field),
+                                                             field=sql.Identifier(field))
+        joins = sql.SQL("").join(
+            sql.SQL(" left join {view} {alias} on {alias}.id = t0.{key}").format(
+                view=sql.Identifier(view), alias=sql.Identifier(f"t{number}"), key=sql.Identifier(key))
+            for number, (view, _, key) in enumerate(cls.SOURCES) if key
+        )
+        where = where if where else sql.SQL("t0.id = {run_id}").format(run_id=sql.Placeholder())
+        return sql.SQL("select {select} from {view} t0{joins} where {where}").format(
+            select=select, view=sql.Identifier(cls.SOURCES[0][0]), joins=joins, where=where)
 
     async def get_data(self):
-        await self.add_run_data()
-        await self.add_invoice_data()
-        await self.add_car_data()
-        await self.add_driver_data()
+        async with sql_handler.AsyncCarsTable(self.SOURCES[0][0]) as _obj:
+            result = await _obj.prepared_dql_handler(("PdfFile.data_query", self.DOC_TYPE_NAME), self.data_query,
+                                                     (self.doc.run_id,))
+        if not result:
+            raise HTTPException(status_code=404, detail="Run not found.")
+        row = dict(result[0])
+        del row["doc_name"]
+        self.doc = self.doc.copy(update=row)
         return True
 
-    def fill_pdf(self):
+    @classmethod
+    async def get_many(cls, run_ids=None, start_day=None, end_day=None) -> list:
+        """
+        Returns the documents with data of the runs with the given IDs, or else of the runs departed in the date
+        range, ordered by departure date. Every document is named after its run (see name_column in DOC_TYPES),
+        or after the run ID if the run has no such document number.
+        """
+        if run_ids:
+            where = sql.SQL("t0.id = any({run_ids})").format(run_ids=sql.Placeholder())
+            params = (list(run_ids),)
+        else:
+            where = sql.SQL("t0.date_departure between {start_day} and {end_day}").format(
+                start_day=sql.Placeholder(), end_day=sql.Placeholder())
+            params = (start_day, end_day)
+        key = ("PdfFile.get_many", cls.DOC_TYPE_NAME, bool(run_ids))
+        async with sql_handler.AsyncCarsTable(cls.SOURCES[0][0]) as _obj:
+            result = await _obj.prepared_dql_handler(
+                key, lambda: cls.data_query(where) + sql.SQL(" order by t0.date_departure, t0.id"), params)
+        documents = []
+        for row in result or ():
+            row = dict(row)
+            document = cls(row["run_id"], row.pop("doc_name") or row["run_id"])
+            document.doc = document.doc.copy(update=row)
+            documents.append(document)
+        return documents
+
+    def fill_data(self) -> dict:
+        """Returns the template field values computed from the document data."""
         if self.FIELDS:
+            values = self.doc.dict()
             for item in self.FIELDS:
                 if 'copyof_' in item:
-                    self.data[item] = self.doc.dict()[item[-item[::-1].find('copyof_'[::-1]):]]
+                    self.data[item] = values[item[-item[::-1].find('copyof_'[::-1]):]]
                 elif '_and_' in item:
-                    self.data[item] = ' '.join([self.doc.dict()[i] for i in item.split('_and_') if self.doc.dict()[i]])
+                    self.data[item] = ' '.join([values[i] for i in item.split('_and_') if values[i]])
                 else:
-                    self.data[item] = self.doc.dict()[item]
-            fillpdfs.write_fillable_pdf(self.template_file, self.output_file, self.data)
+                    self.data[item] = values[item]
+        return self.data
+
+    def cache_key(self, data: dict) -> str:
+        # the values are compared the way they are written into the template
+        return BytesCache.key(template_version(self.template_file), sorted((k, str(v)) for k, v in data.items()))
+
+    def fill_pdf(self):
+        """Fills the template with the document data, or takes it from CACHE; blocking, run it in a thread pool."""
+        if self.FIELDS:
+            data = self.fill_data()
+            key = self.cache_key(data)
+            self.content = self.CACHE.get(key)
+            if self.content is None:
+                self.content = PdfTemplate.render(self.template_file, data)
+                self.CACHE.set(key, self.content)
 
     def get_pdf(self):
-        if self.content is None:
-            with open(self.output_file, "rb") as file:
-                content = file.read()
-            os.remove(self.output_file)
-        return content
+        return self.content
+
+    @classmethod
+    def executor(cls) -> ProcessPoolExecutor:
+        if PdfFile._executor is None:
+            # spawned, not forked: the API process runs the event loop and pool threads
+            PdfFile._executor = ProcessPoolExecutor(max_workers=cls.MAX_WORKERS,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+        return PdfFile._executor
+
+    @classmethod
+    def shutdown(cls):
+        if PdfFile._executor is not None:
+            PdfFile._executor.shutdown(wait=False, cancel_futures=True)
+            PdfFile._executor = None
+
+    @classmethod
+    async def zip_stream(cls, documents):
+        """
+        Yields a ZIP archive of the filled documents named {run_id}.pdf, an entry as soon as a process fills it
+        or at once if it is in CACHE.
+        At most PENDING_PER_WORKER documents per process are submitted ahead, so the memory used does not depend
+        on the number of documents. The entries are stored: the PDF streams are compressed already.
+        """
+        loop = asyncio.get_running_loop()
+        executor = cls.executor()
+        documents = iter(documents)
+        pending = {}
+        output = _ZipOutput()
+        try:
+            with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+                while True:
+                    while len(pending) < cls.MAX_WORKERS * cls.PENDING_PER_WORKER:
+                        document = next(documents, None)
+                        if document is None:
+                            break
+                        data = document.fill_data()
+                        key = document.cache_key(data)
+                        content = cls.CACHE.get(key)
+                        if content is not None:
+                            archive.writestr(f"{document.doc.run_id}.pdf", content)
+                            continue
+                        future = loop.run_in_executor(executor, fill_template, document.template_file, data)
+                        pending[future] = (document, key)
+                    if not pending:
+                        break
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        document, key = pending.pop(future)
+                        cls.CACHE.set(key, future.result())
+                        archive.writestr(f"{document.doc.run_id}.pdf", future.result())
+                    yield output.read()
+            yield output.read()
+        finally:
+            for future in pending:
+                future.cancel()
 
 
 class TN(PdfFile):
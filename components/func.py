@@ -1,12 +1,18 @@
-from typing import List, Tuple
+import base64
+from typing import List, Tuple, Optional
+
+import orjson
+import psycopg2
 from pydantic import BaseModel
 from psycopg2 import sql
 from database import sql_handler
+from components.cache import ViewCache
+from components.responses import dumps
 from fastapi.responses import JSONResponse
-from fastapi import HTTPException
+from fastapi import HTTPException, Request, Response
 
 
-async def get_query(view, cl, where=None):
+def get_query(view, cl, where=None):
     """
     Parameters:
     - view: The name of the database view to retrieve data from. (String)
@@ -23,46 +29,165 @@ async def get_query(view, cl, where=None):
     return select_clause + where_condition
 
 
-async def get_view_data(view, cl, where=None):
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Returns a 304 response if the If-None-Match header of the request matches the etag (weak comparison),
+    otherwise sets the etag on the response and returns None. The etag should be taken before the data is read,
+    so that a change during the read only makes the next request download the data again.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+async def get_view_data(view, cl, where=None, params=None, cache: ViewCache = None):
     """
     This method, get_view_data, is an asynchronous method that retrieves view data based on the provided parameters.
     It returns a list of objects based on the query results.
+    The query is compiled once per (view, class, where) shape and executed as a prepared statement, so the where
+    condition should use sql.Placeholder() for the values passed in params.
     Parameters:
     - view: The view object that represents the table or view from which the data is retrieved.
     - cl: The class that represents the object type to be returned.
     - where: An optional parameter that specifies the conditions for filtering the data.
+    - params: An optional sequence of values for the placeholders of the where condition.
+    - cache: An optional ViewCache; results of the views it holds are read through it and must not be mutated.
     Returns:
     - A list of objects (instances of the class specified by the 'cl' parameter) based on the query results.
+    The objects are built from the rows without validation, see MyModel.from_rows.
+    """
+    key = (view, cl, repr(where))
+    cached = cache is not None and view in cache.views
+    if cached:
+        generation = cache.generation(view)
+        hit, value = cache.get(view, (key, tuple(params or ())))
+        if hit:
+            return value
+    _obj = sql_handler.AsyncCarsTable(view)
+    async with _obj:
+        result = await _obj.prepared_dql_handler(key, lambda: get_query(view, cl, where), params or (),
+                                                 as_tuples=True)
+    result = cl.from_rows(result) if result else None
+    if cached:
+        cache.set(view, (key, tuple(params or ())), result, generation)
+    return result
+
+
+def keyset_page(where, params, key_columns: Tuple[str, ...], limit: Optional[int] = None,
+                cursor: Optional[str] = None):
+    """
+    Extends the where condition with keyset pagination on key_columns, which must identify a row.
+    The rows are ordered by key_columns, start after the row the cursor points to and are limited to limit.
+    Returns the where condition and its params.
     """
-    _obj = sql_handler.CarsTable(view)
-    with _obj:
-        select_clause = await get_query(view, cl, where)
-        result = _obj.dql_handler(select_clause)
-        if result:
-            return [cl(**dict(row)) for row in result[0]]
+    params = tuple(params or ())
+    where = where if where else sql.SQL("")
+    key = sql.SQL(", ").join(map(sql.Identifier, key_columns))
+    if cursor:
+        try:
+            values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+        if not isinstance(values, list) or len(values) != len(key_columns):
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+        condition = sql.SQL("{joint} ({key}) > ({values})").format(
+            joint=sql.SQL(" AND") if where != sql.SQL("") else sql.SQL(" WHERE"),
+            key=key, values=sql.SQL(", ").join([sql.Placeholder()] * len(values)))
+        where += condition
+        params += tuple(values)
+    where += sql.SQL(" ORDER BY {key}").format(key=key)
+    if limit is not None:
+        if limit < 1:
+            raise HTTPException(status_code=400, detail="limit должен быть больше 0")
+        where += sql.SQL(" LIMIT {limit}").format(limit=sql.Placeholder())
+        params += (limit,)
+    return where, params
+
+
+def next_cursor(result, key_columns: Tuple[str, ...], limit: Optional[int]) -> Optional[str]:
+    """Returns the cursor of the page after result, or None if result is the last page."""
+    if limit is None or not result or len(result) < limit:
+        return None
+    values = [getattr(result[-1], column) for column in key_columns]
+    return base64.urlsafe_b64encode(dumps(values)).decode()
+
+
+async def stream_view_data(view, cl, where=None, params=None, page_size: int = 1000):
+    """
+    Yields the view data as newline-delimited JSON, one object of the class cl per line. The rows are read
+    through a server-side cursor page by page, so the memory used does not depend on the number of rows.
+    """
+    async with sql_handler.AsyncCarsTable(view) as _obj:
+        async for rows in _obj.stream_handler(get_query(view, cl, where), params or (), page_size):
+            yield b"".join(dumps(obj) + b"\n" for obj in cl.from_rows(rows))
 
 
 async def post_multiple_objects(data: List[BaseModel], table_name: str):
-    result = []
-    with sql_handler.CarsTable(table_name) as _obj:
-        for item in data:
-            _dict = item.dict(exclude_none=True).copy()
-            if "id" in _dict:
-                del _dict["id"]
-            _result = _obj.insert_data(_dict)
-            result.append(True if isinstance(_result, list) else _result)
+    """
+    Inserts the objects into the table in one transaction with multi-row inserts.
+    Returns a JSONResponse with True for every inserted object or the error message of the rejected one.
+    """
+    rows = []
+    for item in data:
+        _dict = item.dict(exclude_none=True).copy()
+        if "id" in _dict:
+            del _dict["id"]
+        rows.append(_dict)
+    async with sql_handler.AsyncCarsTable(table_name) as _obj:
+        _result = await _obj.insert_many(rows)
+    result = [_item if isinstance(_item, str) else True for _item in _result]
     return JSONResponse(status_code=200, content=result)
 
 
 async def put_multiple_objects(data: List[BaseModel], table_name: str, conditions: Tuple[str]):
-    result = []
-    with sql_handler.CarsTable(table_name) as _obj:
-        for item in data:
-            try:
-                data_dict = {k: v for k, v in item.dict(exclude_none=True).items() if k not in conditions}
-                condition_dict = {k: v for k, v in item.dict(exclude_none=True).items() if k in conditions}
-                _result = _obj.update_data(data_dict, condition_dict)
-                result.append(True if isinstance(_result, list) else _result)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Ошибка в данных {condition_dict}: {e}")
+    """
+    Updates the table rows identified by the `conditions` columns with the other fields of the objects,
+    in one transaction with set-based updates.
+    Returns a JSONResponse with True (updated), False (nothing changed) or the error message for every object.
+    """
+    data_dicts, condition_dicts = [], []
+    for item in data:
+        item_dict = item.dict(exclude_none=True)
+        data_dicts.append({k: v for k, v in item_dict.items() if k not in conditions})
+        condition_dicts.append({k: v for k, v in item_dict.items() if k in conditions})
+    try:
+        async with sql_handler.AsyncCarsTable(table_name) as _obj:
+            result = await _obj.update_many(data_dicts, condition_dicts)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка в данных: {e}")
     return JSONResponse(status_code=200, content=result)
+
+
+def ingest_documents(documents: List[BaseModel], runs: List[BaseModel], conditions: Tuple[str]) -> dict:
+    """
+    Inserts the documents into runs_documents and updates the runs identified by the `conditions` columns,
+    in one transaction: both are COPYed into staging tables and merged with set-based statements.
+    Blocking, run it in a thread pool.
+    Returns {"documents": [...], "runs": [...]} with the outcome of every object, as post_multiple_objects and
+    put_multiple_objects report them; empty fields of the runs keep the current values. A part without
+    rows gives an empty list.
+    """
+    document_columns = [col for col in (documents[0].model_fields if documents else ()) if col != "id"]
+    run_columns = [col for col in (runs[0].model_fields if runs else ()) if col not in conditions]
+    documents_result, runs_result = [], []
+    try:
+        with sql_handler.CarsTable("runs_documents") as documents_table:
+            # an empty part is skipped: there is nothing to stage, and no columns to build the statements from
+            if documents and document_columns:
+                stage = documents_table.stage(document_columns, ([getattr(item, col) for col in document_columns]
+                                                                 for item in documents))
+                documents_result = documents_table.merge_insert(stage, document_columns, {"run_id": "runs"})
+            if runs and run_columns:
+                runs_table = sql_handler.CarsTable("runs").use_connection(documents_table)
+                stage = runs_table.stage((*conditions, *run_columns), ([getattr(item, col) for col in conditions]
+                                                                       + [getattr(item, col) for col in run_columns]
+                                                                       for item in runs))
+                runs_result = runs_table.merge_update(stage, run_columns, conditions)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка в данных: {e}")
+    return {"documents": documents_result, "runs": runs_result}
@@ -1,52 +1,202 @@
-import json
-from io import StringIO
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from io import BytesIO
 
+import httpx
+import orjson
 import pandas as pd
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from components.hash_strings import MagOilPassword
-import requests
+from database.sql_handler import MagOilTable
 
 from models.documents import MagOilReport
 
 
 class MagOilInterface:
-    def __init__(self, data: MagOilReport, credentials: MagOilPassword = MagOilPassword()):
-        self.__df = None
-        self.session = requests.session()
-        self.credentials = credentials
-        self.login_headers = {
-            'x-requested-with': 'XMLHttpRequest',
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'User-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                          'Chrome/81.0.4044.129 Safari/537.36',
-        }
-        self.data = data
-        self.session.headers = self.login_headers
+    """
+    Async client of the MagOil fuel cards site. One instance is shared by the requests: the HTTP connections and
+    the login session (a cookie) are reused, the two-step login is done again only when the session is older than
+    AUTH_TTL or the site answers 401/403. Failed requests (connection errors, timeouts, 5xx) are retried RETRIES
+    times with a growing delay. base_url and transport point the client to a stand-in server in tests.
+    """
+    BASE_URL = "http://18.215.116.239"
+    CLIENT_ID = 87
+    TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+    RETRIES = 3
+    RETRY_DELAY = 0.5
+    AUTH_TTL = 20 * 60
+    LOGIN_HEADERS = {
+        'x-requested-with': 'XMLHttpRequest',
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'User-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                      'Chrome/81.0.4044.129 Safari/537.36',
+    }
+
+    def __init__(self, base_url: str = BASE_URL, credentials: MagOilPassword = None,
+                 timeout: httpx.Timeout = TIMEOUT, retries: int = RETRIES, transport: httpx.AsyncBaseTransport = None):
+        self.base_url = base_url
+        self.credentials = credentials or MagOilPassword()
+        self.timeout = timeout
+        self.retries = retries
+        self.transport = transport
+        self._client = None
+        self._authorized_at = None
+        self._session = 0
+        self._auth_lock = asyncio.Lock()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, headers=self.LOGIN_HEADERS,
+                                             timeout=self.timeout, transport=self.transport)
+        return self._client
 
     @property
-    def df(self):
-        if self.__df is None:
-            self.authorize()
-            self.__df = self.get_csv()
-        return self.__df
-
-    def authorize(self):
-        response = self.session.get(f'http://18.215.116.239/cards/group/index/list/clientId/87'
-                                    f'?act=auth&login={self.credentials.login}')
-        r_j = response.json()
-        self.credentials.auth_key = r_j['auth_key']
-        self.credentials.salt = r_j['salt']
-        creds = self.credentials.crypt_password()
-        self.session.get(f'http://18.215.116.239/cards/group/index/list/clientId/87'
-                         f'?act=auth&password={creds}&auth_key={self.credentials.auth_key}')
-
-    def get_csv(self):
-        csv = self.session.get(f'http://18.215.116.239/cards/report/card/export-csv/'
-                               f'datestart/{self.data.start_date.strftime('%d.%m.%Y')}/'
-                               f'dateend/{self.data.end_date.strftime('%d.%m.%Y')}/clientId/87')
-        csv_decoded = csv.content.decode('utf-8-sig')
-        df = pd.read_csv(StringIO(csv_decoded), sep=';')
-        return df
-
-    def get_json(self):
-        return json.dumps(self.df.fillna('').to_dict(orient="records"), ensure_ascii=False)
+    def authorized(self) -> bool:
+        return self._authorized_at is not None and time.monotonic() - self._authorized_at < self.AUTH_TTL
+
+    async def request(self, url: str, params: dict = None) -> httpx.Response:
+        """GET with retries; returns the response of the last attempt, 401/403 included."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.get(url, params=params)
+                if response.status_code < 500:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = repr(e)
+            logging.warning(f"MagOil {url} attempt {attempt + 1} failed: {error}")
+            if attempt < self.retries:
+                await asyncio.sleep(self.RETRY_DELAY * 2 ** attempt)
+        raise HTTPException(status_code=502, detail=f"MagOil недоступен: {error}")
+
+    @staticmethod
+    def check(response: httpx.Response) -> httpx.Response:
+        """Reports an error response of MagOil as a 502, like its unavailability."""
+        if response.is_error:
+            raise HTTPException(status_code=502, detail=f"MagOil: HTTP {response.status_code}")
+        return response
+
+    async def authorize(self, rejected: int = None) -> int:
+        """
+        Logs in if the session has expired, or if it is still the session `rejected` by the site, and returns
+        the number of the current session.
+        """
+        async with self._auth_lock:
+            # the requests waiting for the lock find the session renewed by the first one
+            if self.authorized and self._session != rejected:
+                return self._session
+            url = f"/cards/group/index/list/clientId/{self.CLIENT_ID}"
+            response = self.check(await self.request(url, {"act": "auth", "login": self.credentials.login}))
+            try:
+                r_j = response.json()
+                self.credentials.auth_key = r_j['auth_key']
+                self.credentials.salt = r_j['salt']
+            except (ValueError, KeyError, TypeError):
+                raise HTTPException(status_code=502, detail="MagOil: unexpected login response")
+            creds = self.credentials.crypt_password()
+            self.check(await self.request(url, {"act": "auth", "password": creds,
+                                                "auth_key": self.credentials.auth_key}))
+            self._authorized_at = time.monotonic()
+            self._session += 1
+            return self._session
+
+    async def get(self, url: str) -> httpx.Response:
+        """GET of a page behind the login, logging in first or again when the session has expired."""
+        session = await self.authorize()
+        response = await self.request(url)
+        if response.status_code in (401, 403):
+            await self.authorize(rejected=session)
+            response = await self.request(url)
+        return self.check(response)
+
+    async def get_csv(self, data: MagOilReport) -> pd.DataFrame:
+        csv = await self.get(f"/cards/report/card/export-csv/datestart/{data.start_date.strftime('%d.%m.%Y')}/"
+                             f"dateend/{data.end_date.strftime('%d.%m.%Y')}/clientId/{self.CLIENT_ID}")
+        return await run_in_threadpool(self.read_csv, csv.content)
+
+    @staticmethod
+    def read_csv(content: bytes) -> pd.DataFrame:
+        try:
+            return pd.read_csv(BytesIO(content), sep=';', encoding='utf-8-sig')
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._authorized_at = None
+
+
+class MagOilStore:
+    """
+    Serves the MagOil report from MagOilTable, the local copy of the transactions, one day per partition.
+
+    refresh() downloads the days of a period not loaded yet or loaded before they were RECENT_DAYS old (late
+    transactions still change them), CONCURRENCY days at a time, each day replacing its partition. The report
+    downloads only the days it lacks and today, whose transactions are still coming in, so a report on past loaded
+    days is a local query; the scheduler keeps the last HISTORY_DAYS days fresh and prune() drops the older ones.
+    """
+    RECENT_DAYS = 3
+    HISTORY_DAYS = 62
+    CONCURRENCY = 4
+
+    def __init__(self, interface: MagOilInterface):
+        self.interface = interface
+
+    def stale_days(self, start: date, end: date, missing_only: bool = False) -> list:
+        """Blocking, run it in a thread pool. With missing_only, the loaded days are stale only if today."""
+        with MagOilTable() as table:
+            loaded = table.loaded_days(start, end)
+        days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+        return [day for day in days if day not in loaded or day == date.today()
+                or not missing_only and loaded[day].date() <= day + timedelta(days=self.RECENT_DAYS)]
+
+    @staticmethod
+    def store_day(day: date, df: pd.DataFrame) -> int:
+        """Blocking, run it in a thread pool."""
+        records = (orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+                   for record in df.fillna('').to_dict(orient="records"))
+        with MagOilTable() as table:
+            return table.replace_day(day, records)
+
+    async def load_day(self, semaphore: asyncio.Semaphore, day: date) -> int:
+        async with semaphore:
+            df = await self.interface.get_csv(MagOilReport(start_date=day, end_date=day))
+            return await run_in_threadpool(self.store_day, day, df)
+
+    async def refresh(self, start: date = None, end: date = None, missing_only: bool = False) -> dict:
+        """Loads the stale days of the period, the last HISTORY_DAYS days by default; returns their row counts."""
+        end = min(end or date.today(), date.today())
+        start = start or end - timedelta(days=self.HISTORY_DAYS)
+        if start > end:
+            return {}
+        days = await run_in_threadpool(self.stale_days, start, end, missing_only)
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+        rows = await asyncio.gather(*(self.load_day(semaphore, day) for day in days))
+        return dict(zip(days, rows))
+
+    @classmethod
+    def prune(cls) -> list:
+        """Drops the days older than the last HISTORY_DAYS days and returns them. Blocking."""
+        with MagOilTable() as table:
+            return table.drop_days_before(date.today() - timedelta(days=cls.HISTORY_DAYS))
+
+    async def get_json(self, data: MagOilReport) -> str:
+        await self.refresh(data.start_date, data.end_date, missing_only=True)
+        return await run_in_threadpool(self.read_days, data.start_date, data.end_date)
+
+    @staticmethod
+    def read_days(start: date, end: date) -> str:
+        """Blocking, run it in a thread pool."""
+        with MagOilTable() as table:
+            return table.get_days_json(start, end)
+
+
+magoil = MagOilInterface()
+magoil_store = MagOilStore(magoil)
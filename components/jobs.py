@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import logging
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import orjson
+from fastapi import HTTPException, UploadFile, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+
+class Job:
+    """A unit of background work and its state, as reported by the jobs status endpoint."""
+
+    def __init__(self, kind: str, key, options: dict = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        # the parameters of the work, which a coalesced submission may change while the job is queued
+        self.options = options or {}
+        self.status = "queued"
+        self.progress = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "kind": self.kind, "options": self.options, "status": self.status,
+                "progress": self.progress,
+                "created": self.created, "started": self.started, "finished": self.finished,
+                "duration": self.duration, "result": self.result, "error": self.error}
+
+
+class JobManager:
+    """
+    Runs background jobs of the API process on the event loop, at most max_workers at a time.
+
+    A job submitted while another one of the same kind and key is queued or running is not started: the running
+    job is returned instead. Finished jobs are kept for the status endpoint, the oldest beyond max_jobs dropped.
+    """
+    MAX_WORKERS = 2
+    MAX_JOBS = 200
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_jobs: int = MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._tasks = set()
+
+    def submit(self, kind: str, key, work, options: dict = None) -> Job:
+        """
+        Schedules work(job), a coroutine function, and returns its job. The value work returns becomes
+        the job result (the body of a returned Response), a raised HTTPException its error.
+        """
+        active = self._active.get((kind, key))
+        if active is not None:
+            return active
+        job = Job(kind, key, options)
+        self._active[(kind, key)] = job
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.finished is None:
+                break
+            del self._jobs[oldest.id]
+        task = asyncio.create_task(self._run(job, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def submit_upload(self, kind: str, file: UploadFile, work) -> Job:
+        """
+        Copies the uploaded file, which is closed when the request ends, and schedules work(job, upload) on the copy.
+        Uploads of the same content are coalesced.
+        """
+        upload, digest = await run_in_threadpool(self.copy_upload, file)
+        if (kind, digest) in self._active:
+            await upload.close()
+            return self._active[(kind, digest)]
+
+        async def run(job):
+            try:
+                return await work(job, upload)
+            finally:
+                await upload.close()
+        return self.submit(kind, digest, run)
+
+    @staticmethod
+    def copy_upload(file: UploadFile) -> tuple:
+        """Returns a copy of the uploaded file and the SHA-256 of its content. Blocking, run it in a thread pool."""
+        copy = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        digest = hashlib.sha256()
+        size = 0
+        file.file.seek(0)
+        while chunk := file.file.read(1024 * 1024):
+            digest.update(chunk)
+            copy.write(chunk)
+            size += len(chunk)
+        copy.seek(0)
+        return UploadFile(copy, size=size, filename=file.filename, headers=file.headers), digest.hexdigest()
+
+    async def _run(self, job: Job, work):
+        async with self._semaphore:
+            job.status = "running"
+            job.started = time.time()
+            try:
+                result = await work(job)
+                job.result = orjson.loads(result.body) if isinstance(result, Response) else result
+                job.status = "done"
+            except HTTPException as e:
+                job.status = "failed"
+                job.error = e.detail
+            except Exception as e:
+                logging.exception(f"job {job.kind} {job.id} failed")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished = time.time()
+                self._active.pop((job.kind, job.key), None)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        return list(self._jobs.values())
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @staticmethod
+    def accepted(job: Job) -> JSONResponse:
+        """The 202 response of a submitted job."""
+        return JSONResponse(status_code=202, content=job.as_dict(), headers={"Location": f"/api/jobs/{job.id}"})
+
+
+jobs = JobManager()
@@ -0,0 +1,35 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+
+def _default(obj):
+    # orjson calls this for the types it can not encode itself; the output matches the pydantic JSON mode
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoded with orjson. Models are encoded from their fields without validation or jsonable_encoder,
+    so a route returning it directly skips the response_model processing, e.g. a list route must return [] itself
+    for no rows; the response_model is still used for the OpenAPI schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class NDJSONResponse(StreamingResponse):
+    """StreamingResponse of newline-delimited JSON, one object per line, see func.stream_view_data."""
+    media_type = "application/x-ndjson"
@@ -1,41 +1,446 @@
+import aiopg
 import psycopg2
-from psycopg2 import sql, extras, errors
+from psycopg2 import sql, extras, errors, extensions, pool
+import asyncio
+import collections
+import io
+import itertools
 import json
+import logging
+import multiprocessing
+import os
+import queue
 import re
+import threading
+import time
+import weakref
 from abc import ABC
+from datetime import date, timedelta
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived psycopg2 connections to one database.
+
+    Idle connections are kept up to max_size, so a burst of requests reuses already authenticated sessions.
+    When every connection is borrowed, getconn waits up to `timeout` seconds for one to be returned.
+    A connection that has been idle longer than `check_interval` seconds is pinged before it is handed out.
+    """
+
+    def __init__(self, min_size: int, max_size: int, timeout: float, check_interval: float, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.connect_kwargs = connect_kwargs
+        self._idle = collections.deque()
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._counters = {"borrowed": 0, "created": 0, "discarded": 0, "waits": 0, "timeouts": 0}
+        for _ in range(self.min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        # the counters change under the (reentrant) lock, like the idle list, so stats() sees consistent values
+        with self._condition:
+            self._counters["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._condition:
+            self._counters["discarded"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_alive(self, conn, idle_since: float) -> bool:
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise pool.PoolError("connection pool exhausted")
+                self._counters["waits"] += 1
+                self._condition.wait(remaining)
+            idle = self._idle.pop() if self._idle else None
+            self._in_use += 1
+        try:
+            conn = None
+            if idle is not None:
+                conn, idle_since = idle
+                if not self._is_alive(conn, idle_since):
+                    self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._counters["borrowed"] += 1
+        return conn
+
+    def putconn(self, conn):
+        status = extensions.TRANSACTION_STATUS_UNKNOWN if conn.closed else conn.info.transaction_status
+        if status not in (extensions.TRANSACTION_STATUS_IDLE, extensions.TRANSACTION_STATUS_UNKNOWN):
+            try:
+                conn.rollback()
+                status = conn.info.transaction_status
+            except psycopg2.Error:
+                status = extensions.TRANSACTION_STATUS_UNKNOWN
+        with self._condition:
+            self._in_use -= 1
+            if status == extensions.TRANSACTION_STATUS_IDLE:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._condition.notify()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"min_size": self.min_size, "max_size": self.max_size, "idle": len(self._idle),
+                    "in_use": self._in_use, **self._counters}
+
+
+class CopyPipe:
+    """
+    Bounded in-memory pipe between `COPY ... TO STDOUT` running on one connection and `COPY ... FROM STDIN`
+    running on another.
+
+    The writer side accumulates rows into chunks of `chunk_size` bytes and blocks while `max_chunks` chunks
+    are waiting to be read, so at most about chunk_size * max_chunks bytes are held in memory.
+    """
+    _EOF = object()
+
+    def __init__(self, chunk_size: int = 256 * 1024, max_chunks: int = 8):
+        self.chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._pending = bytearray()
+        self._buffer = memoryview(b"")
+        self._reader_closed = threading.Event()
+        self._writer_error = None
+        self._eof = False
+
+    def _put(self, item):
+        while True:
+            if self._reader_closed.is_set():
+                raise BrokenPipeError("COPY reader has stopped")
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self._pending += data
+        if len(self._pending) >= self.chunk_size:
+            self._put(bytes(self._pending))
+            self._pending.clear()
+        return len(data)
+
+    def close_writer(self, error: BaseException = None):
+        self._writer_error = error
+        if error is None and self._pending:
+            self._put(bytes(self._pending))
+        self._pending.clear()
+        try:
+            self._put(self._EOF)
+        except BrokenPipeError:
+            pass
+
+    def read(self, size: int = -1):
+        while not self._buffer and not self._eof:
+            chunk = self._chunks.get()
+            if chunk is self._EOF:
+                self._eof = True
+                if self._writer_error is not None:
+                    raise IOError(f"COPY writer failed: {self._writer_error}")
+            else:
+                self._buffer = memoryview(chunk)
+        size = len(self._buffer) if size is None or size < 0 else size
+        data, self._buffer = bytes(self._buffer[:size]), self._buffer[size:]
+        return data
+
+    def close_reader(self):
+        self._reader_closed.set()
 
 
 class DataBase:
     CREDENTIALS_FILE = r"database/sql_credentials.json"
+    POOL_MIN_SIZE = 1
+    POOL_MAX_SIZE = 10
+    POOL_TIMEOUT = 30  # seconds to wait for a free connection
+    POOL_CHECK_INTERVAL = 60  # seconds of idleness after which a connection is pinged before reuse
+    _credentials = None
+    _pools = {}
+    _pools_pid = None
+    _pools_lock = threading.Lock()
 
     def __init__(self, db):
         self.db = db
 
+    @property
+    def pool(self) -> ConnectionPool:
+        with self._pools_lock:
+            if DataBase._pools_pid != os.getpid():
+                # connections inherited through fork belong to the parent process, never reuse them here
+                DataBase._pools = {}
+                DataBase._pools_pid = os.getpid()
+            if self.db not in DataBase._pools:
+                credentials = self.load_credentials()[self.db]
+                DataBase._pools[self.db] = ConnectionPool(
+                    min_size=credentials.get("pool_min_size", self.POOL_MIN_SIZE),
+                    max_size=credentials.get("pool_max_size", self.POOL_MAX_SIZE),
+                    timeout=credentials.get("pool_timeout", self.POOL_TIMEOUT),
+                    check_interval=credentials.get("pool_check_interval", self.POOL_CHECK_INTERVAL),
+                    host=credentials["host"],
+                    port=credentials["port"],
+                    database=credentials["database"],
+                    user=credentials["user"],
+                    password=credentials["password"],
+                )
+            return DataBase._pools[self.db]
+
     def open_connection(self):
-        credentials = self.load_credentials()
-        return psycopg2.connect(
-            host=credentials[self.db]["host"],
-            port=credentials[self.db]["port"],
-            database=credentials[self.db]["database"],
-            user=credentials[self.db]["user"],
-            password=credentials[self.db]["password"],
-        )
+        return self.pool.getconn()
+
+    def close_connection(self, conn):
+        self.pool.putconn(conn)
 
     @staticmethod
     def open_cursor(conn):
         return conn.cursor(cursor_factory=extras.DictCursor)
 
     def load_credentials(self):
-        with open(self.CREDENTIALS_FILE, "r") as f:
-            return json.load(f)
+        if DataBase._credentials is None:
+            with open(self.CREDENTIALS_FILE, "r") as f:
+                DataBase._credentials = json.load(f)
+        return DataBase._credentials
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        if cls._pools_pid != os.getpid():
+            return {}
+        return {db: _pool.stats() for db, _pool in cls._pools.items()}
+
+
+class AsyncDataBase(DataBase):
+    """
+    Asyncio counterpart of DataBase: connections come from an aiopg pool bound to the running event loop,
+    so the coroutine waiting for a query yields the loop to other requests.
+
+    pool_timeout bounds the wait for a free connection as in DataBase; query_timeout is the aiopg limit of every
+    operation on a connection, and pool_recycle the age after which aiopg closes an idle connection (never by
+    default).
+    """
+    QUERY_TIMEOUT = aiopg.DEFAULT_TIMEOUT
+    POOL_RECYCLE = -1
+    _async_pools = {}
+    _async_pools_lock = None
+
+    async def get_pool(self) -> aiopg.Pool:
+        if AsyncDataBase._async_pools_lock is None:
+            AsyncDataBase._async_pools_lock = asyncio.Lock()
+        async with AsyncDataBase._async_pools_lock:
+            if self.db not in AsyncDataBase._async_pools:
+                credentials = self.load_credentials()[self.db]
+                AsyncDataBase._async_pools[self.db] = await aiopg.create_pool(
+                    minsize=credentials.get("pool_min_size", self.POOL_MIN_SIZE),
+                    maxsize=credentials.get("pool_max_size", self.POOL_MAX_SIZE),
+                    timeout=credentials.get("query_timeout", self.QUERY_TIMEOUT),
+                    pool_recycle=credentials.get("pool_recycle", self.POOL_RECYCLE),
+                    enable_hstore=False,
+                    host=credentials["host"],
+                    port=credentials["port"],
+                    database=credentials["database"],
+                    user=credentials["user"],
+                    password=credentials["password"],
+                )
+            return AsyncDataBase._async_pools[self.db]
+
+    async def open_connection(self):
+        _pool = await self.get_pool()
+        timeout = self.load_credentials()[self.db].get("pool_timeout", self.POOL_TIMEOUT)
+        try:
+            return await asyncio.wait_for(_pool.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise pool.PoolError("connection pool exhausted")
+
+    async def close_connection(self, conn):
+        await (await self.get_pool()).release(conn)
+
+    @staticmethod
+    async def open_cursor(conn):
+        return await conn.cursor(cursor_factory=extras.DictCursor)
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        return {db: {"min_size": _pool.minsize, "max_size": _pool.maxsize, "idle": _pool.freesize,
+                     "in_use": _pool.size - _pool.freesize} for db, _pool in cls._async_pools.items()}
+
+    async def listen(self, channel: str, callback, retry_delay: float = 5):
+        """
+        Calls callback(payload) for every notification sent on the channel, reconnecting when the connection
+        is lost. callback(None) is called after every (re)connection, because notifications sent while nobody
+        was listening are lost.
+        """
+        credentials = self.load_credentials()[self.db]
+        while True:
+            try:
+                async with aiopg.connect(host=credentials["host"], port=credentials["port"],
+                                         database=credentials["database"], user=credentials["user"],
+                                         password=credentials["password"], enable_hstore=False) as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(sql.SQL("LISTEN {channel}").format(channel=sql.Identifier(channel)))
+                    callback(None)
+                    while True:
+                        callback((await conn.notifies.get()).payload)
+            except (psycopg2.Error, OSError) as e:
+                logging.warning(f"listening on {channel} interrupted: {e}")
+                await asyncio.sleep(retry_delay)
+
+    @classmethod
+    async def close_pools(cls):
+        for _pool in cls._async_pools.values():
+            _pool.close()
+            await _pool.wait_closed()
+        cls._async_pools = {}
+
+
+class SchemaCache:
+    """
+    Process-wide cache of table metadata (columns, primary key) keyed by (database, table).
+
+    Invalidation drops the matching local entries and bumps a version shared with the processes forked from
+    this one (the scheduler), which then drop all their entries on the next lookup.
+    """
+    _entries = {}
+    _lock = threading.Lock()
+    _shared_version = multiprocessing.Value("i", 0)
+    _local_version = 0
+    _counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @classmethod
+    def get(cls, db: str, table_name: str, key: str, loader):
+        with cls._lock:
+            if cls._local_version != cls._shared_version.value:
+                cls._entries = {}
+                cls._local_version = cls._shared_version.value
+            entry = cls._entries.get((db, table_name), {})
+            if key in entry:
+                cls._counters["hits"] += 1
+                return entry[key]
+            cls._counters["misses"] += 1
+        value = loader()
+        with cls._lock:
+            cls._entries.setdefault((db, table_name), {})[key] = value
+        return value
+
+    @classmethod
+    def invalidate(cls, db: str = None, table_name: str = None):
+        with cls._lock:
+            cls._entries = {k: v for k, v in cls._entries.items()
+                            if not ((db is None or k[0] == db) and (table_name is None or k[1] == table_name))}
+            with cls._shared_version.get_lock():
+                cls._shared_version.value += 1
+                cls._local_version = cls._shared_version.value
+            cls._counters["invalidations"] += 1
+
+    @classmethod
+    def prefetch(cls, table_names):
+        """
+        Loads the metadata of the tables from both databases, so the first sync skips the catalog queries.
+        A database that can not be reached is skipped at its first table instead of being waited for at each one.
+        """
+        for table_class in (Db1cTable, CarsTable):
+            for table_name in table_names:
+                try:
+                    with table_class(table_name) as _obj:
+                        _obj.columns, _obj.primary_key
+                except (psycopg2.OperationalError, pool.PoolError, OSError) as e:
+                    logging.warning(f"schema prefetch of {table_class.__name__} skipped: {e}")
+                    break
+                except psycopg2.Error as e:
+                    logging.warning(f"schema prefetch of {table_name} failed: {e}")
+
+    @classmethod
+    def version(cls) -> int:
+        return cls._shared_version.value
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            return {"version": cls._local_version, "tables": len(cls._entries), **cls._counters}
+
+
+class PreparedStatements:
+    """
+    Registry of server-side prepared statements for the async tables.
+
+    A query shape is composed and rendered to SQL once per process, prepared once per pooled connection and
+    then only executed, so repeated requests skip both the query composition and the Postgres planning.
+    Statement names carry the schema cache version: after the schema cache is invalidated every connection
+    prepares the statements anew.
+    """
+    MAX_STATEMENTS = 256
+    _statements = collections.OrderedDict()
+    _prepared = weakref.WeakKeyDictionary()
+    _names = itertools.count()
+    _placeholder = re.compile(r"%[s%]")
+
+    @classmethod
+    def get(cls, key, build_query, conn) -> tuple:
+        """Returns (name, PREPARE statement, EXECUTE statement) of the query shape identified by key."""
+        key = (key, SchemaCache.version())
+        if key in cls._statements:
+            cls._statements.move_to_end(key)
+            return cls._statements[key]
+        text = build_query().as_string(conn.raw)
+        numbers = itertools.count(1)
+        body = cls._placeholder.sub(lambda m: "%" if m.group() == "%%" else f"${next(numbers)}", text)
+        params_count = next(numbers) - 1
+        name = f"q{next(cls._names)}_v{key[1]}"
+        execute = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * params_count)})" if params_count else "")
+        cls._statements[key] = (name, f"PREPARE {name} AS {body}", execute)
+        if len(cls._statements) > cls.MAX_STATEMENTS:
+            cls._statements.popitem(last=False)
+        return cls._statements[key]
+
+    @classmethod
+    def is_prepared(cls, conn, name) -> bool:
+        return name in cls._prepared.get(conn, ())
+
+    @classmethod
+    def mark_prepared(cls, conn, name):
+        cls._prepared.setdefault(conn, set()).add(name)
 
 
 class Table(ABC):
+    UNIQUE_VIOLATION_MESSAGE = "duplicate keys forbidden"
+    FOREIGN_KEY_VIOLATION_MESSAGE = "car or driver or invoice does not exists or defined"
+    MISSING_RECORD_MESSAGE = "The record with the ID does not exist or ID is not defined."
+
     def __init__(self, db: DataBase, table_name):
         self.db = db
         self.table_name = table_name
-        self.__columns = None
-        self.__primary_key = None
         self.__data = None
         self.table_conn = None
         self.table_cur = None
@@ -63,39 +468,71 @@ class Table(ABC):
                 self.table_conn.commit()
         except errors.UniqueViolation:
             self.table_conn.rollback()
-            return str("duplicate keys forbidden")
+            return self.UNIQUE_VIOLATION_MESSAGE
         except errors.ForeignKeyViolation:
             self.table_conn.rollback()
-            return str("car or driver or invoice does not exists or defined")
+            return self.FOREIGN_KEY_VIOLATION_MESSAGE
         return result
 
+    def use_connection(self, other: "Table"):
+        """Makes this table run its queries inside the open transaction of another table of the same database."""
+        self.table_conn = other.table_conn
+        self.table_cur = other.table_cur
+        return self
+
+    def copy_to(self, target: "Table", copy_out: sql.Composable, copy_in: sql.Composable):
+        """
+        Streams the output of the `COPY ... TO STDOUT` statement run on this table's connection into the
+        `COPY ... FROM STDIN` statement run on the target's connection, in bounded chunks.
+        """
+        pipe = CopyPipe()
+
+        def produce():
+            try:
+                self.table_cur.copy_expert(copy_out, pipe, size=pipe.chunk_size)
+            except BaseException as e:
+                pipe.close_writer(e)
+            else:
+                pipe.close_writer()
+
+        producer = threading.Thread(target=produce, name=f"copy_{self.table_name}", daemon=True)
+        producer.start()
+        try:
+            target.table_cur.copy_expert(copy_in, pipe, size=pipe.chunk_size)
+        finally:
+            pipe.close_reader()
+            producer.join()
+        return target.table_cur.rowcount
+
     @staticmethod
     def create_where_statement(conditions: dict) -> sql.Composed:
         return sql.SQL(" WHERE ") + sql.SQL(" and ").join(sql.SQL("{column_name}={value}").format(
             column_name=sql.Identifier(k), value=sql.Literal(v)) for k, v in conditions.items())
 
+    def load_columns(self):
+        query = sql.SQL(
+            "SELECT column_name FROM information_schema.columns where table_name = {"
+            "table_name}"
+        ).format(table_name=sql.Literal(self.table_name))
+        sql_response = self.dql_handler(query)
+        return sql_response[0] if sql_response else None
+
+    def load_primary_key(self):
+        query = sql.SQL(
+            "SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid "
+            "AND a.attnum = ANY(i.indkey) WHERE  i.indrelid = {table_name}::regclass "
+            "and i.indisprimary is true"
+        ).format(table_name=sql.Literal(self.table_name))
+        sql_response = self.dql_handler(query)
+        return sql_response[0][0] if sql_response else None
+
     @property
     def columns(self):
-        if self.__columns is None:
-            query = sql.SQL(
-                "SELECT column_name FROM information_schema.columns where table_name = {"
-                "table_name}"
-            ).format(table_name=sql.Literal(self.table_name))
-            sql_response = self.dql_handler(query)
-            self.__columns = sql_response[0] if sql_response else None
-        return self.__columns
+        return SchemaCache.get(self.db.db, self.table_name, "columns", self.load_columns)
 
     @property
     def primary_key(self):
-        if self.__primary_key is None:
-            query = sql.SQL(
-                "SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid "
-                "AND a.attnum = ANY(i.indkey) WHERE  i.indrelid = {table_name}::regclass "
-                "and i.indisprimary is true"
-            ).format(table_name=sql.Literal(self.table_name))
-            sql_response = self.dql_handler(query)
-            self.__primary_key = sql_response[0][0] if sql_response else None
-        return self.__primary_key
+        return SchemaCache.get(self.db.db, self.table_name, "primary_key", self.load_primary_key)
 
     @property
     def data(self):
@@ -113,15 +550,120 @@ class Table(ABC):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
-            self.table_conn.commit()
+        try:
+            if exc_type is None:
+                self.table_conn.commit()
+            else:
+                self.table_conn.rollback()
+                print(exc_val)
+        finally:
+            # the pool discards the connection if it is broken or still inside a transaction
             self.table_cur.close()
-            self.table_conn.close()
-        else:
-            self.table_conn.rollback()
+            self.db.close_connection(self.table_conn)
+
+
+class AsyncTable(Table, ABC):
+    """
+    Table whose queries are awaited on an aiopg connection.
+
+    aiopg connections run in autocommit mode, so the context manager opens an explicit transaction on enter
+    and commits or rolls it back on exit. Every DML statement runs inside its own savepoint: a failed statement
+    is undone alone, the same way the sync dml_handler commits each statement separately.
+    """
+
+    def __init__(self, db: AsyncDataBase, table_name):
+        super().__init__(db, table_name)
+
+    async def dql_handler(self, *queries):
+        result = []
+        for query in queries:
+            await self.table_cur.execute(query)
+            _result = await self.table_cur.fetchall()
+            if _result:
+                result.append(_result)
+        return result if result else None
+
+    async def prepared_dql_handler(self, key, build_query, params=(), as_tuples=False):
+        """
+        Executes the query identified by key as a server-side prepared statement and returns all its rows.
+        build_query is called only the first time the key is seen and must return a query with placeholders
+        for params. With as_tuples=True the rows are plain tuples instead of DictRow objects.
+        """
+        name, prepare, execute = PreparedStatements.get(key, build_query, self.table_conn)
+        if not PreparedStatements.is_prepared(self.table_conn, name):
+            await self.table_cur.execute(prepare)
+            PreparedStatements.mark_prepared(self.table_conn, name)
+        if not as_tuples:
+            await self.table_cur.execute(execute, params)
+            return await self.table_cur.fetchall()
+        cur = await self.table_conn.cursor()
+        try:
+            await cur.execute(execute, params)
+            return await cur.fetchall()
+        finally:
+            cur.close()
+
+    async def stream_handler(self, query, params=(), page_size: int = 1000):
+        """
+        Yields the rows of the query as lists of at most page_size tuples, fetched from a server-side cursor,
+        so only one page is held in memory. Runs inside the transaction opened by the context manager,
+        which closes the cursor on exit.
+        """
+        cur = await self.table_conn.cursor()
+        try:
+            await cur.execute(sql.SQL("DECLARE stream_handler NO SCROLL CURSOR FOR ") + query, params)
+            while True:
+                await cur.execute("FETCH FORWARD %s FROM stream_handler", (page_size,))
+                rows = await cur.fetchall()
+                if rows:
+                    yield rows
+                if len(rows) < page_size:
+                    break
+        finally:
+            cur.close()
+
+    async def dml_handler(self, *queries):
+        result = []
+        for query in queries:
+            await self.table_cur.execute("SAVEPOINT dml_handler")
+            try:
+                await self.table_cur.execute(query)
+                result.append(
+                    {
+                        "lastrowid": await self.table_cur.fetchone(),
+                        "rowcount": self.table_cur.rowcount,
+                    }
+                )
+            except errors.UniqueViolation:
+                await self.table_cur.execute("ROLLBACK TO SAVEPOINT dml_handler")
+                return self.UNIQUE_VIOLATION_MESSAGE
+            except errors.ForeignKeyViolation:
+                await self.table_cur.execute("ROLLBACK TO SAVEPOINT dml_handler")
+                return self.FOREIGN_KEY_VIOLATION_MESSAGE
+            await self.table_cur.execute("RELEASE SAVEPOINT dml_handler")
+        return result
+
+    async def __aenter__(self):
+        self.table_conn = await self.db.open_connection()
+        try:
+            self.table_cur = await self.db.open_cursor(self.table_conn)
+            await self.table_cur.execute("BEGIN")
+        except Exception:
+            await self.db.close_connection(self.table_conn)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                await self.table_cur.execute("COMMIT")
+            else:
+                await self.table_cur.execute("ROLLBACK")
+                logging.error(f"{self.table_name} transaction rolled back: {exc_val!r}")
+        finally:
+            # a connection left inside a transaction is closed by the pool instead of being reused
             self.table_cur.close()
-            self.table_conn.close()
-            print(exc_val)
+            await self.db.close_connection(self.table_conn)
 
 
 class Db1cTable(Table):
@@ -129,10 +671,99 @@ class Db1cTable(Table):
         super().__init__(DataBase("db1c"), table_name)
 
 
-class CarsTable(Table):
+class CarsQueries:
+    """SQL builders shared by the sync and the async tables of the cars database."""
+
+    def select_query(self, where=None) -> sql.Composed:
+        where_clause = where if where else sql.SQL("")
+        return sql.SQL("SELECT * FROM {view} {where}").format(
+            view=sql.Identifier(self.table_name), where=where_clause
+        )
+
+    def insert_query(self, columns_data) -> sql.Composed:
+        return (
+                sql.SQL("insert into {table_name} (").format(
+                    table_name=sql.Identifier(self.table_name)
+                )
+                + sql.SQL(", ").join(sql.Identifier(col) for col in columns_data.keys())
+                + sql.SQL(") values (")
+                + sql.SQL(", ").join(sql.Literal(val) for val in columns_data.values())
+                + sql.SQL(") returning id")
+        )
+
+    def insert_many_query(self, columns, rows_count: int) -> sql.Composed:
+        row_placeholders = sql.SQL("({})").format(sql.SQL(", ").join(sql.Placeholder() for _ in columns))
+        return sql.SQL("insert into {table_name} ({column_names}) values {rows} returning id").format(
+            table_name=sql.Identifier(self.table_name),
+            column_names=sql.SQL(", ").join(sql.Identifier(col) for col in columns),
+            rows=sql.SQL(", ").join(row_placeholders for _ in range(rows_count)),
+        )
+
+    def update_many_query(self, columns, conditions, rows_count: int) -> sql.Composed:
+        """
+        Updates many rows in one statement and returns, in input order, whether each row was updated and
+        whether it exists at all. The empty select from the table gives the VALUES rows the column types.
+        """
+        keys = list(conditions)
+        column_names = sql.SQL(", ").join(sql.Identifier(col) for col in keys + list(columns))
+        row_placeholders = sql.SQL("({})").format(sql.SQL(", ").join(sql.Placeholder() for _ in range(
+            len(keys) + len(columns) + 1)))
+        key_match = sql.SQL(" and ").join(sql.SQL("{t}.{col} = v.{col}").format(t=sql.Identifier(self.table_name),
+                                                                               col=sql.Identifier(col))
+                                          for col in keys)
+        return sql.SQL(
+            "with v as (select null::int as input_row, {column_names} from {table_name} where false "
+            "union all values {rows}), "
+            "updated as (update {table_name} set {updates} from v where {key_match} "
+            "and ({current}) is distinct from ({new}) returning v.input_row) "
+            "select v.input_row, exists (select from updated u where u.input_row = v.input_row) as updated, "
+            "exists (select from {table_name} where {key_match}) as found from v order by v.input_row"
+        ).format(
+            table_name=sql.Identifier(self.table_name),
+            column_names=column_names,
+            rows=sql.SQL(", ").join(row_placeholders for _ in range(rows_count)),
+            updates=sql.SQL(", ").join(sql.SQL("{col} = v.{col}").format(col=sql.Identifier(col)) for col in columns),
+            key_match=key_match,
+            current=sql.SQL(", ").join(sql.SQL("{t}.{col}").format(t=sql.Identifier(self.table_name),
+                                                                   col=sql.Identifier(col)) for col in columns),
+            new=sql.SQL(", ").join(sql.SQL("v.{col}").format(col=sql.Identifier(col)) for col in columns),
+        )
+
+    def current_values_query(self, columns_data, condition_data) -> sql.Composed:
+        return (
+                sql.SQL("select {columns} from {table_name}").format(
+                    columns=sql.SQL(", ").join(sql.Identifier(col) for col in columns_data.keys()),
+                    table_name=sql.Identifier(self.table_name),)
+                + self.create_where_statement(condition_data)
+        )
+
+    def update_query(self, columns_data, condition_data) -> sql.Composed:
+        return (
+                sql.SQL("update {table_name} set ").format(table_name=sql.Identifier(self.table_name))
+                + sql.SQL(", ").join(sql.SQL("{column_name}={value}").format(column_name=sql.Identifier(k),
+                                                                             value=sql.Literal(v))
+                                     for k, v in columns_data.items())
+                + self.create_where_statement(condition_data)
+                + sql.SQL(" returning id")
+        )
+
+    def delete_query(self, condition_data) -> sql.Composed:
+        return (
+                sql.SQL("delete from {table_name}").format(
+                    table_name=sql.Identifier(self.table_name)
+                )
+                + self.create_where_statement(condition_data)
+                + sql.SQL(" returning id")
+        )
+
+
+class CarsTable(CarsQueries, Table):
     def __init__(self, table_name):
         super().__init__(DataBase("cars"), table_name)
 
+    SYNC_STATE_TABLE = "sync_state"
+    SYNC_CHANNEL = "cars_sync"
+
     def create_temp_table(self):
         query = sql.SQL(
             "CREATE TEMP TABLE {name} (like {table_name} excluding all including INDEXES) on commit drop; "
@@ -142,35 +773,113 @@ class CarsTable(Table):
         self.table_cur.execute(query)
         return f'temp_{self.table_name}'
 
-    def fill_temp_table(self):
+    def create_temp_keys_table(self):
+        query = sql.SQL(
+            "CREATE TEMP TABLE {name} on commit drop as select {p_key} from {table_name} with no data"
+        ).format(name=sql.Identifier('temp_keys_' + self.table_name),
+                 p_key=sql.Identifier(self.primary_key[0]),
+                 table_name=sql.Identifier(self.table_name))
+        self.table_cur.execute(query)
+        return f'temp_keys_{self.table_name}'
+
+    def create_sync_state(self):
+        """
+        Creates the table of the sync watermarks. Run it in a transaction of its own before the syncs: created
+        inside the transactions of concurrent syncs, the table would be created by all of them at once.
+        """
+        # IF NOT EXISTS does not stop two sessions creating the same table at once, hence the lock
+        self.table_cur.execute(sql.SQL(
+            "select pg_advisory_xact_lock(hashtext({name})); "
+            "CREATE TABLE IF NOT EXISTS {state} (table_name text primary key, watermark bigint not null, "
+            "synced_at timestamptz not null default now())"
+        ).format(name=sql.Literal(self.SYNC_STATE_TABLE), state=sql.Identifier(self.SYNC_STATE_TABLE)))
+
+    def get_sync_watermark(self):
+        """
+        Returns the 64-bit transaction id stored by the last successful incremental sync of the table:
+        every 1C row changed after that sync has an xmin not lower than it.
+        """
+        query = sql.SQL("select watermark from {state} where table_name = {table_name}").format(
+            state=sql.Identifier(self.SYNC_STATE_TABLE), table_name=sql.Literal(self.table_name)
+        )
+        sql_response = self.dql_handler(query)
+        return sql_response[0][0][0] if sql_response else None
+
+    def set_sync_watermark(self, watermark: int):
+        query = sql.SQL(
+            "insert into {state} (table_name, watermark) values ({table_name}, {watermark}) "
+            "on conflict (table_name) do update set watermark = excluded.watermark, synced_at = now()"
+        ).format(state=sql.Identifier(self.SYNC_STATE_TABLE), table_name=sql.Literal(self.table_name),
+                 watermark=sql.Literal(watermark))
+        self.table_cur.execute(query)
+
+    def fill_temp_table(self, incremental: bool = False):
+        """
+        Copies the 1C table into a temporary table and returns the names of the temporary table and of the
+        table holding every primary key that still exists in 1C.
+
+        With incremental=True only the rows changed since the last successful sync are copied (their xmin
+        is not lower than the stored watermark) and the keys are copied into a separate keys-only table.
+        The watermark is the oldest transaction still running when the 1C snapshot was taken, so nothing
+        committed later can be missed. A transaction id epoch change or a missing watermark falls back
+        to the full copy.
+        """
         db1c_table = Db1cTable(self.table_name)
         temp_table = self.create_temp_table()
+        keys_table = temp_table
         with db1c_table:
-            query = sql.SQL(
-                "insert into {table_name} values ({placeholders})"
-            ).format(
-                table_name=sql.Identifier(temp_table),
-                placeholders=sql.SQL(", ").join(sql.Placeholder() for _ in db1c_table.columns)
+            # the watermark, the keys and the changed rows must all come from the same 1C snapshot
+            db1c_table.table_cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            snapshot = db1c_table.dql_handler(sql.SQL("SELECT txid_snapshot_xmin(txid_current_snapshot())"))
+            watermark = snapshot[0][0][0]
+            column_names = sql.SQL(", ").join(sql.Identifier(i[0]) for i in db1c_table.columns)
+            where = sql.SQL("")
+            if incremental:
+                last_watermark = self.get_sync_watermark()
+                if last_watermark is not None and last_watermark >> 32 == watermark >> 32:
+                    where = sql.SQL(" WHERE xmin::text::bigint >= {xid}").format(
+                        xid=sql.Literal(last_watermark & 0xFFFFFFFF)
+                    )
+                    keys_table = self.create_temp_keys_table()
+                    copy_keys_out = sql.SQL("COPY (SELECT {p_key} FROM {table_name}) TO STDOUT").format(
+                        p_key=sql.Identifier(self.primary_key[0]), table_name=sql.Identifier(self.table_name)
+                    )
+                    copy_keys_in = sql.SQL("COPY {table_name} FROM STDIN").format(
+                        table_name=sql.Identifier(keys_table)
+                    )
+                    db1c_table.copy_to(self, copy_keys_out, copy_keys_in)
+            copy_out = sql.SQL("COPY (SELECT {column_names} FROM {table_name}{where}) TO STDOUT").format(
+                column_names=column_names, table_name=sql.Identifier(self.table_name), where=where
             )
-            if db1c_table.data:
-                for row in db1c_table.data:
-                    self.table_cur.execute(query, row)
-        return temp_table
+            copy_in = sql.SQL("COPY {table_name} ({column_names}) FROM STDIN").format(
+                table_name=sql.Identifier(temp_table), column_names=column_names
+            )
+            db1c_table.copy_to(self, copy_out, copy_in)
+            if incremental:
+                self.set_sync_watermark(watermark)
+        return temp_table, keys_table
 
-    def sync(self):
+    def sync(self, full: bool = False) -> bool:
+        """
+        Syncs the table from 1C and returns True if its content changed. A change is announced on SYNC_CHANNEL
+        with the table name as payload; Postgres delivers it when the transaction commits.
+        """
         _reference_pattern = re.compile(r"^_(reference|document)\d+$")
-        temp_table = self.fill_temp_table()
         columns = list(self.columns)
+        changed = False
         if ['id'] in columns:
             columns.remove(['id'])
-            # the query for delete all records from the main table that are not in the temporary table
-            delete_query = sql.SQL("delete from {table_name} where {p_key} not in (select {p_key} from {temp_table})"
+            temp_table, keys_table = self.fill_temp_table(incremental=not full)
+            # the query for delete all records from the main table whose keys are no longer in 1C
+            delete_query = sql.SQL("delete from {table_name} r where not exists "
+                                   "(select from {keys_table} k where k.{p_key} = r.{p_key})"
                                    ).format(
                 table_name=sql.Identifier(self.table_name),
                 p_key=sql.Identifier(self.primary_key[0]),
-                temp_table=sql.Identifier(temp_table)
+                keys_table=sql.Identifier(keys_table)
             )
             self.table_cur.execute(delete_query)
+            changed = self.table_cur.rowcount > 0
         # the query for insert all records from the temporary table that are not in the main table
             updates = [sql.SQL("{column_name} = excluded.{column_name}").format(column_name=sql.Identifier(i[0]))
                        for i in columns
@@ -188,70 +897,342 @@ class CarsTable(Table):
                 column_names=sql.SQL(", ").join([sql.Identifier(i[0]) for i in columns]),
                 conditions=conditions,
             )
+            self.table_cur.execute(insert_query)
+            changed = changed or self.table_cur.rowcount > 0
         elif not bool(self.primary_key) and not re.fullmatch(_reference_pattern, self.table_name):
-            insert_query = sql.SQL(
-                "truncate {table_name};"
-                "insert into {table_name} as r ({column_names}) select {column_names} from {temp_table}"
+            temp_table, _ = self.fill_temp_table()
+            column_names = sql.SQL(", ").join([sql.Identifier(i[0]) for i in columns])
+            # the table is rewritten only if its rows differ from the 1C ones
+            diff_query = sql.SQL(
+                "select exists ((select {column_names} from {table_name} except all "
+                "select {column_names} from {temp_table}) union all (select {column_names} from {temp_table} "
+                "except all select {column_names} from {table_name}))"
             ).format(
                 table_name=sql.Identifier(self.table_name),
                 temp_table=sql.Identifier(temp_table),
-                column_names=sql.SQL(", ").join([sql.Identifier(i[0]) for i in columns]),
+                column_names=column_names,
             )
-        else:
-            insert_query = sql.SQL('select 1;')
-        self.table_cur.execute(insert_query)
+            changed = self.dql_handler(diff_query)[0][0][0]
+            if changed:
+                insert_query = sql.SQL(
+                    "truncate {table_name};"
+                    "insert into {table_name} as r ({column_names}) select {column_names} from {temp_table}"
+                ).format(
+                    table_name=sql.Identifier(self.table_name),
+                    temp_table=sql.Identifier(temp_table),
+                    column_names=column_names,
+                )
+                self.table_cur.execute(insert_query)
+        if changed:
+            self.table_cur.execute(sql.SQL("select pg_notify({channel}, {table_name})").format(
+                channel=sql.Literal(self.SYNC_CHANNEL), table_name=sql.Literal(self.table_name)))
+        return changed
 
-    def get_data(self, where=None):
-        where_clause = where if where else sql.SQL("")
-        query = sql.SQL("SELECT * FROM {view} {where}").format(
-            view=sql.Identifier(self.table_name), where=where_clause
+    @staticmethod
+    def copy_text(value) -> str:
+        """Formats a value for COPY in text format."""
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def stage(self, columns, rows) -> sql.Identifier:
+        """
+        Creates a temp table of input_row and the columns, typed as in this table and dropped at commit, and COPYs
+        the rows (sequences of values in the column order) into it, numbered from 0 in input_row.
+        """
+        stage = sql.Identifier(f"stage_{self.table_name}")
+        self.table_cur.execute(sql.SQL(
+            "create temp table {stage} on commit drop as "
+            "select null::int as input_row, {columns} from {table_name} with no data"
+        ).format(stage=stage, table_name=sql.Identifier(self.table_name),
+                 columns=sql.SQL(", ").join(map(sql.Identifier, columns))))
+        data = io.StringIO()
+        for input_row, row in enumerate(rows):
+            data.write("\t".join(map(self.copy_text, (input_row, *row))) + "\n")
+        data.seek(0)
+        self.table_cur.copy_expert(sql.SQL("copy {stage} from stdin").format(stage=stage), data)
+        return stage
+
+    def merge_insert(self, stage: sql.Identifier, columns, references: dict) -> list:
+        """
+        Inserts the staged rows in one statement and returns, for every row in input order, True or the error
+        message insert_data would return for it. `references` maps columns to the tables whose id they reference:
+        rows referencing a missing id are not inserted, rows conflicting with a unique key are skipped.
+        """
+        cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+        referenced = sql.SQL(" and ").join(
+            sql.SQL("exists (select from {table} r where r.id = s.{column})").format(
+                table=sql.Identifier(table), column=sql.Identifier(column))
+            for column, table in references.items()
+        ) if references else sql.SQL("true")
+        match = sql.SQL(" and ").join(sql.SQL("c.{col} = i.{col}").format(col=sql.Identifier(col))
+                                      for col in columns)
+        # inserted rows are matched back to the staged ones by their values, duplicates in insert (id) order
+        query = sql.SQL(
+            "with candidates as (select s.*, row_number() over (partition by {cols} order by s.input_row) as n "
+            "from {stage} s where {referenced}), "
+            "inserted as (insert into {table_name} ({cols}) select {cols} from candidates order by input_row "
+            "on conflict do nothing returning {table_name}.*), "
+            "numbered as (select i.*, row_number() over (partition by {cols} order by i.id) as n from inserted i) "
+            "select s.input_row, c.input_row is not null as referenced, i.id is not null as inserted "
+            "from {stage} s left join candidates c on c.input_row = s.input_row "
+            "left join numbered i on {match} and i.n = c.n order by s.input_row"
+        ).format(stage=stage, table_name=sql.Identifier(self.table_name), cols=cols, referenced=referenced,
+                 match=match)
+        self.table_cur.execute(query)
+        return [True if inserted else self.UNIQUE_VIOLATION_MESSAGE if referenced
+                else self.FOREIGN_KEY_VIOLATION_MESSAGE
+                for _, referenced, inserted in self.table_cur.fetchall()]
+
+    def merge_update(self, stage: sql.Identifier, columns, conditions) -> list:
+        """
+        Updates the rows matching the staged ones on the `conditions` columns in one statement; staged NULLs
+        keep the current values. Returns, for every row in input order, what update_data would return for it:
+        True if the row was updated, False if nothing changed, or the message for a missing row.
+        """
+        key_match = sql.SQL(" and ").join(sql.SQL("t.{col} = s.{col}").format(col=sql.Identifier(col))
+                                          for col in conditions)
+        new = [sql.SQL("coalesce(s.{col}, t.{col})").format(col=sql.Identifier(col)) for col in columns]
+        query = sql.SQL(
+            "with updated as (update {table_name} t set {updates} from {stage} s where {key_match} "
+            "and ({current}) is distinct from ({new}) returning s.input_row) "
+            "select s.input_row, u.input_row is not null as updated, "
+            "exists (select from {table_name} t where {key_match}) as found "
+            "from {stage} s left join updated u on u.input_row = s.input_row order by s.input_row"
+        ).format(
+            table_name=sql.Identifier(self.table_name), stage=stage, key_match=key_match,
+            updates=sql.SQL(", ").join(sql.SQL("{col} = {value}").format(col=sql.Identifier(col), value=value)
+                                       for col, value in zip(columns, new)),
+            current=sql.SQL(", ").join(sql.SQL("t.{col}").format(col=sql.Identifier(col)) for col in columns),
+            new=sql.SQL(", ").join(new),
         )
-        sql_response = self.dql_handler(query)
+        self.table_cur.execute(query)
+        return [updated if found else self.MISSING_RECORD_MESSAGE
+                for _, updated, found in self.table_cur.fetchall()]
+
+    def get_data(self, where=None):
+        sql_response = self.dql_handler(self.select_query(where))
         return sql_response[0] if sql_response else None
 
     def insert_data(self, columns_data):
-        insert = (
-                sql.SQL("insert into {table_name} (").format(
-                    table_name=sql.Identifier(self.table_name)
-                )
-                + sql.SQL(", ").join(sql.Identifier(col) for col in columns_data.keys())
-                + sql.SQL(") values (")
-                + sql.SQL(", ").join(sql.Literal(val) for val in columns_data.values())
-                + sql.SQL(") returning id")
-        )
-        return self.dml_handler(insert)
+        return self.dml_handler(self.insert_query(columns_data))
 
     def update_data(self, columns_data, condition_data):
-        select = (
-                sql.SQL("select {columns} from {table_name}").format(
-                    columns=sql.SQL(", ").join(sql.Identifier(col) for col in columns_data.keys()),
-                    table_name=sql.Identifier(self.table_name),)
-                + self.create_where_statement(condition_data)
-        )
         try:
-            sql_response = self.dql_handler(select)
+            sql_response = self.dql_handler(self.current_values_query(columns_data, condition_data))
             result = sql_response[0][0]
             result = {k: result[k] for k in columns_data.keys()}
             if result == columns_data:
                 return False
         except IndexError:
-            return str("The record with the ID does not exist or ID is not defined.")
-        update = (
-                sql.SQL("update {table_name} set ").format(table_name=sql.Identifier(self.table_name))
-                + sql.SQL(", ").join(sql.SQL("{column_name}={value}").format(column_name=sql.Identifier(k),
-                                                                             value=sql.Literal(v))
-                                     for k, v in columns_data.items())
-                + self.create_where_statement(condition_data)
-                + sql.SQL(" returning id")
-        )
-        return self.dml_handler(update)
+            return self.MISSING_RECORD_MESSAGE
+        return self.dml_handler(self.update_query(columns_data, condition_data))
 
     def delete_data(self, condition_data):
-        delete = (
-                sql.SQL("delete from {table_name}").format(
-                    table_name=sql.Identifier(self.table_name)
-                )
-                + self.create_where_statement(condition_data)
-                + sql.SQL(" returning id")
-        )
-        return self.dml_handler(delete)
+        return self.dml_handler(self.delete_query(condition_data))
+
+
+class MagOilTable(CarsTable):
+    """
+    Local copy of the MagOil card transactions: a table partitioned by day, one partition per loaded day, and the
+    table of loaded days with their row count, which tells a day without transactions from a day not loaded.
+    Rows are stored as the json records of the MagOil CSV export, in file order.
+    """
+    DAYS_TABLE = "magoil_days"
+
+    def __init__(self, table_name: str = "magoil_transactions"):
+        super().__init__(table_name)
+
+    def create_tables(self):
+        # IF NOT EXISTS does not stop two sessions creating the same table at once, hence the lock
+        self.table_cur.execute(sql.SQL(
+            "select pg_advisory_xact_lock(hashtext({name})); "
+            "CREATE TABLE IF NOT EXISTS {table_name} (day date not null, line int not null, data json not null, "
+            "primary key (day, line)) PARTITION BY RANGE (day); "
+            "CREATE TABLE IF NOT EXISTS {days} (day date primary key, rows int not null, "
+            "loaded_at timestamptz not null default now())"
+        ).format(name=sql.Literal(self.table_name), table_name=sql.Identifier(self.table_name),
+                 days=sql.Identifier(self.DAYS_TABLE)))
+
+    def partition_name(self, day: date) -> sql.Identifier:
+        return sql.Identifier(f"{self.table_name}_{day:%Y%m%d}")
+
+    def partition(self, day: date) -> sql.Identifier:
+        """Creates the partition of the day if it does not exist and returns its name."""
+        partition = self.partition_name(day)
+        self.table_cur.execute(sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table_name} FOR VALUES FROM ({day}) TO ({next_day})"
+        ).format(partition=partition, table_name=sql.Identifier(self.table_name), day=sql.Literal(day),
+                 next_day=sql.Literal(day + timedelta(days=1))))
+        return partition
+
+    def lock_day(self, day: date):
+        """Waits for the other loads or drops of the day; the advisory lock is held until the commit."""
+        self.table_cur.execute(sql.SQL("select pg_advisory_xact_lock(hashtext({table_name}), {day} - {epoch})").format(
+            table_name=sql.Literal(self.table_name), day=sql.Literal(day), epoch=sql.Literal(date(2000, 1, 1))))
+
+    def loaded_days(self, start: date, end: date) -> dict:
+        """Returns the loaded days between start and end, inclusive, with the time they were loaded."""
+        self.create_tables()
+        query = sql.SQL("select day, loaded_at from {days} where day between {start} and {end}").format(
+            days=sql.Identifier(self.DAYS_TABLE), start=sql.Literal(start), end=sql.Literal(end))
+        sql_response = self.dql_handler(query)
+        return {day: loaded_at for day, loaded_at in sql_response[0]} if sql_response else {}
+
+    def replace_day(self, day: date, records) -> int:
+        """
+        Replaces the rows of the day by the records (json texts) and marks the day loaded, in the transaction of
+        the table. Loads of the same day wait for each other on an advisory lock held until the commit; readers
+        are not blocked and see the former rows of the day until the commit (DELETE, not TRUNCATE).
+        The first load of a day creates its partition, which locks the whole table for that short moment.
+        """
+        self.lock_day(day)
+        partition = self.partition(day)
+        self.table_cur.execute(sql.SQL("DELETE FROM {partition}").format(partition=partition))
+        data = io.StringIO()
+        rows = 0
+        for rows, record in enumerate(records, start=1):
+            data.write("\t".join(map(self.copy_text, (day, rows, record))) + "\n")
+        data.seek(0)
+        self.table_cur.copy_expert(sql.SQL("copy {partition} (day, line, data) from stdin").format(
+            partition=partition), data)
+        self.table_cur.execute(sql.SQL(
+            "insert into {days} (day, rows) values ({day}, {rows}) "
+            "on conflict (day) do update set rows = excluded.rows, loaded_at = now()"
+        ).format(days=sql.Identifier(self.DAYS_TABLE), day=sql.Literal(day), rows=sql.Literal(rows)))
+        return rows
+
+    def drop_days_before(self, day: date) -> list:
+        """
+        Drops the partitions of the days loaded before the day and returns these days. The locks of all the days
+        are taken before the first partition is dropped, which locks the whole table: a load waiting for that
+        lock while holding its day lock can not deadlock with the drop.
+        """
+        self.create_tables()
+        query = sql.SQL("select day from {days} where day < {day} order by day").format(
+            days=sql.Identifier(self.DAYS_TABLE), day=sql.Literal(day))
+        sql_response = self.dql_handler(query)
+        days = [row[0] for row in sql_response[0]] if sql_response else []
+        for _day in days:
+            self.lock_day(_day)
+        for _day in days:
+            self.table_cur.execute(sql.SQL("DROP TABLE IF EXISTS {partition}").format(
+                partition=self.partition_name(_day)))
+        if days:
+            self.table_cur.execute(sql.SQL("delete from {days} where day = any({dropped})").format(
+                days=sql.Identifier(self.DAYS_TABLE), dropped=sql.Literal(days)))
+        return days
+
+    def get_days_json(self, start: date, end: date) -> str:
+        """Returns the rows between start and end, inclusive, as a JSON array built by the database."""
+        query = sql.SQL(
+            "select coalesce(json_agg(data order by day, line), '[]')::text from {table_name} "
+            "where day between {start} and {end}"
+        ).format(table_name=sql.Identifier(self.table_name), start=sql.Literal(start), end=sql.Literal(end))
+        return self.dql_handler(query)[0][0][0]
+
+
+class AsyncCarsTable(CarsQueries, AsyncTable):
+    BULK_PAGE_SIZE = 1000
+
+    def __init__(self, table_name):
+        super().__init__(AsyncDataBase("cars"), table_name)
+
+    @staticmethod
+    def group_by_columns(rows) -> dict:
+        """Groups row indexes by the set of columns of the row: rows of one statement must share the columns."""
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(tuple(row.keys()), []).append(i)
+        return groups
+
+    async def insert_many(self, rows) -> list:
+        """
+        Inserts the rows with multi-row INSERT statements inside the open transaction and returns, for every row,
+        its new id or the error message insert_data would return for it.
+
+        A statement that violates a unique or foreign key is rolled back to its savepoint and its rows are
+        inserted one by one, so only the offending rows are rejected. Sequence values are not rolled back: every
+        row the failed statement inserted before the violation keeps its id used, so a rejected page leaves a gap
+        of up to BULK_PAGE_SIZE ids. The ids are only keys, nothing relies on them being contiguous.
+        """
+        result = [None] * len(rows)
+        for columns, indexes in self.group_by_columns(rows).items():
+            for start in range(0, len(indexes), self.BULK_PAGE_SIZE):
+                page = indexes[start:start + self.BULK_PAGE_SIZE]
+                params = [rows[i][col] for i in page for col in columns]
+                await self.table_cur.execute("SAVEPOINT insert_many")
+                try:
+                    await self.table_cur.execute(self.insert_many_query(columns, len(page)), params)
+                    ids = await self.table_cur.fetchall()
+                except (errors.UniqueViolation, errors.ForeignKeyViolation):
+                    await self.table_cur.execute("ROLLBACK TO SAVEPOINT insert_many")
+                    for i in page:
+                        _result = await self.insert_data(rows[i])
+                        result[i] = _result if isinstance(_result, str) else _result[0]["lastrowid"][0]
+                    continue
+                await self.table_cur.execute("RELEASE SAVEPOINT insert_many")
+                # rows of a multi-row VALUES insert are returned in the order they were listed
+                for i, row_id in zip(page, ids):
+                    result[i] = row_id[0]
+        return result
+
+    async def update_many(self, columns_data, conditions_data) -> list:
+        """
+        Updates many rows with single UPDATE ... FROM (VALUES ...) statements inside the open transaction.
+        Returns, for every row, what update_data would return for it: True if the row was updated,
+        False if nothing changed, or the error message if the row is missing or the update was rejected.
+        """
+        result = [None] * len(columns_data)
+        shapes = {}
+        for i, (columns, conditions) in enumerate(zip(columns_data, conditions_data)):
+            shapes.setdefault((tuple(columns.keys()), tuple(conditions.keys())), []).append(i)
+        for (columns, conditions), indexes in shapes.items():
+            if not conditions:
+                for i in indexes:
+                    result[i] = self.MISSING_RECORD_MESSAGE
+                continue
+            if not columns:
+                for i in indexes:
+                    _result = await self.update_data(columns_data[i], conditions_data[i])
+                    result[i] = True if isinstance(_result, list) else _result
+                continue
+            for start in range(0, len(indexes), self.BULK_PAGE_SIZE):
+                page = indexes[start:start + self.BULK_PAGE_SIZE]
+                params = [value for n, i in enumerate(page)
+                          for value in (n, *conditions_data[i].values(), *columns_data[i].values())]
+                await self.table_cur.execute("SAVEPOINT update_many")
+                try:
+                    await self.table_cur.execute(self.update_many_query(columns, conditions, len(page)), params)
+                    outcomes = await self.table_cur.fetchall()
+                except (errors.UniqueViolation, errors.ForeignKeyViolation):
+                    await self.table_cur.execute("ROLLBACK TO SAVEPOINT update_many")
+                    for i in page:
+                        _result = await self.update_data(columns_data[i], conditions_data[i])
+                        result[i] = True if isinstance(_result, list) else _result
+                    continue
+                await self.table_cur.execute("RELEASE SAVEPOINT update_many")
+                for input_row, updated, found in outcomes:
+                    result[page[input_row]] = updated if found else self.MISSING_RECORD_MESSAGE
+        return result
+
+    async def get_data(self, where=None):
+        sql_response = await self.dql_handler(self.select_query(where))
+        return sql_response[0] if sql_response else None
+
+    async def insert_data(self, columns_data):
+        return await self.dml_handler(self.insert_query(columns_data))
+
+    async def update_data(self, columns_data, condition_data):
+        try:
+            sql_response = await self.dql_handler(self.current_values_query(columns_data, condition_data))
+            result = sql_response[0][0]
+            result = {k: result[k] for k in columns_data.keys()}
+            if result == columns_data:
+                return False
+        except IndexError:
+            return self.MISSING_RECORD_MESSAGE
+        return await self.dml_handler(self.update_query(columns_data, condition_data))
+
+    async def delete_data(self, condition_data):
+        return await self.dml_handler(self.delete_query(condition_data))
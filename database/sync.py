@@ -0,0 +1,85 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from database import sql_handler
+
+
+class SyncOrchestrator:
+    """
+    Runs the sync of groups of 1C tables into the cars database on a bounded pool of worker threads.
+
+    Each group is synced in a single transaction, so the views built on its tables never see a half-synced
+    state. Independent groups run concurrently; a group listed in `dependencies` starts only after all groups
+    it depends on have been committed and is skipped if any of them failed.
+    """
+    MAX_WORKERS = 3
+
+    def __init__(self, groups: dict, dependencies: dict = None, max_workers: int = None):
+        self.groups = groups
+        self.dependencies = dependencies or {}
+        self.max_workers = max_workers or self.MAX_WORKERS
+
+    def sync_group(self, group: str, full: bool = False) -> dict:
+        durations = {}
+        tables = self.groups[group]
+        with sql_handler.CarsTable(tables[0]) as head:
+            for table in tables:
+                start = time.perf_counter()
+                sql_handler.CarsTable(table).use_connection(head).sync(full=full)
+                durations[table] = round(time.perf_counter() - start, 3)
+                logging.info(f"{group}: {table} synced in {durations[table]} s")
+        return durations
+
+    def run(self, names=None, full: bool = False) -> dict:
+        """
+        Syncs the given groups (all groups by default) together with the groups they depend on.
+        Returns for every group its status, total duration and per-table durations in seconds.
+        """
+        pending = self._with_dependencies(names or self.groups.keys())
+        with sql_handler.CarsTable(sql_handler.CarsTable.SYNC_STATE_TABLE) as state:
+            state.create_sync_state()
+        report = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sync") as executor:
+            while pending or running:
+                for group in list(pending):
+                    deps = self.dependencies.get(group, ())
+                    if any(report.get(dep, {}).get("status") not in (None, "ok") for dep in deps):
+                        report[group] = {"status": "skipped", "error": "dependency failed", "tables": {}}
+                        pending.remove(group)
+                    elif all(dep in report for dep in deps):
+                        running[executor.submit(self._timed_sync_group, group, full)] = group
+                        pending.remove(group)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report[running.pop(future)] = future.result()
+        return report
+
+    def _timed_sync_group(self, group: str, full: bool) -> dict:
+        start = time.perf_counter()
+        try:
+            tables = self.sync_group(group, full)
+        except Exception as e:
+            logging.exception(f"{group} sync failed")
+            return {"status": "error", "error": str(e), "duration": round(time.perf_counter() - start, 3),
+                    "tables": {}}
+        return {"status": "ok", "duration": round(time.perf_counter() - start, 3), "tables": tables}
+
+    def _with_dependencies(self, names) -> list:
+        result = []
+        visiting = set()
+
+        def add(group):
+            if group in visiting:
+                raise ValueError(f"Sync dependencies of {group} are circular")
+            if group not in result:
+                visiting.add(group)
+                for dep in self.dependencies.get(group, ()):
+                    add(dep)
+                visiting.remove(group)
+                result.append(group)
+
+        for name in names:
+            add(name)
+        return result
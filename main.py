@@ -2,9 +2,18 @@ import os
 
 from routes.mmk_oracle import router as mmk_router
 from routes.front_interaction import router as front
+from routes import front_interaction
 from routes.documents import router as documents
+from routes.service import router as service
+from routes.jobs import router as jobs_router
 from routines import schedulers
+from database.sql_handler import AsyncDataBase, SchemaCache, CarsTable
+from components.fill_template import PdfFile
+from components.jobs import jobs
+from components.interfaces import magoil
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 import time
 import multiprocessing
 import schedule
@@ -25,6 +34,10 @@ tags_metadata = [
         "name": "Documents",
         "description": "Operations with documents."
     },
+    {
+        "name": "Service",
+        "description": "Monitoring and maintenance of the application."
+    },
 ]
 
 configure_logger()
@@ -32,11 +45,23 @@ app = FastAPI(redoc_url=None, openapi_tags=tags_metadata)
 app.include_router(mmk_router, tags=["MMK"])
 app.include_router(front, tags=["Site"])
 app.include_router(documents, tags=["Documents"])
+app.include_router(service, tags=["Service"])
+app.include_router(jobs_router, tags=["Service"])
+
+
+def prefetch_schema():
+    try:
+        SchemaCache.prefetch([table for tables in front_interaction.TABLES.values() for table in tables])
+    except Exception:
+        # the metadata is then loaded on first use
+        logging.exception("schema prefetch failed")
 
 
 def task_scheduler():
     logging.info(f"task_scheduler started")
+    prefetch_schema()
     schedule.every(10).minutes.do(schedulers.update_from_db1c)
+    schedule.every(15).minutes.do(schedulers.refresh_magoil)
 
     while True:
         schedule.run_pending()
@@ -44,6 +69,24 @@ def task_scheduler():
 
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     p = multiprocessing.Process(target=task_scheduler, daemon=True)
     p.start()
+    # in the background, so a slow or down database does not delay serving the requests
+    app.state.schema_prefetch = asyncio.create_task(run_in_threadpool(prefetch_schema))
+
+
+@app.on_event("startup")
+async def listen_sync_event():
+    # The scheduler process syncs 1C tables and notifies this process to drop the views cached on them
+    app.state.sync_listener = asyncio.create_task(
+        AsyncDataBase("cars").listen(CarsTable.SYNC_CHANNEL, front_interaction.on_table_synced))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.sync_listener.cancel()
+    await jobs.close()
+    await magoil.close()
+    PdfFile.shutdown()
+    await AsyncDataBase.close_pools()
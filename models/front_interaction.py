@@ -1,8 +1,21 @@
 from pydantic import BaseModel
-from datetime import datetime, date
+from datetime import datetime, date, time
 from psycopg2 import sql
-from typing import Optional, List
+from typing import Optional, List, get_args
 from decimal import Decimal
+from functools import cache
+
+
+def _to_datetime(value):
+    return datetime.combine(value, time())
+
+
+def _to_decimal(value):
+    return Decimal(str(value))
+
+
+# conversions from the Python types psycopg2 returns to the field type, for the fields where they differ
+ROW_CONVERTERS = {float: float, datetime: _to_datetime, Decimal: _to_decimal}
 
 
 class MyModel(BaseModel):
@@ -13,6 +26,48 @@ class MyModel(BaseModel):
             sql.SQL(",").join(map(sql.Identifier, column_names))
         )
 
+    @classmethod
+    @cache
+    def row_layout(cls) -> tuple:
+        """
+        Returns the field names in the column order of generate_select_query and the (field, type, converter)
+        triples for the fields whose database value may come as another Python type than the field type.
+        """
+        fields = tuple(cls.__annotations__.keys())
+        converters = []
+        for name in fields:
+            annotation = cls.model_fields[name].annotation
+            types = [t for t in get_args(annotation) if t is not type(None)] or [annotation]
+            if len(types) == 1 and types[0] in ROW_CONVERTERS:
+                converters.append((name, types[0], ROW_CONVERTERS[types[0]]))
+        return fields, tuple(converters)
+
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        """
+        Builds models from the rows of a query made by generate_select_query without validating them:
+        the rows come from our own views, so only the values whose Python type differs from the field type
+        are converted. The instances are filled the same way model_construct does, minus its per-field
+        default handling, because every field is present in the row.
+        """
+        fields, converters = cls.row_layout()
+        fields_set = frozenset(fields)
+        new, set_attr = cls.__new__, object.__setattr__
+        result = []
+        for row in rows:
+            values = dict(zip(fields, row))
+            for name, field_type, convert in converters:
+                value = values[name]
+                if value is not None and value.__class__ is not field_type:
+                    values[name] = convert(value)
+            obj = new(cls)
+            set_attr(obj, "__dict__", values)
+            set_attr(obj, "__pydantic_fields_set__", set(fields_set))
+            set_attr(obj, "__pydantic_extra__", None)
+            set_attr(obj, "__pydantic_private__", None)
+            result.append(obj)
+        return result
+
 
 class Car(MyModel, BaseModel):
     id: int
@@ -1,12 +1,16 @@
-from typing import Optional
+from typing import Optional, List
 
-from fastapi import APIRouter, UploadFile, HTTPException, Response
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, HTTPException, Response, Query
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 
 from components.datafiles import IncomeDocsDF, ClientDocsDF, RunsDFClientWeight, RunsDFWeight
-from components.func import post_multiple_objects, put_multiple_objects
+from components.func import ingest_documents
+from components.jobs import jobs, JobManager
 from components.fill_template import TN
-from components.interfaces import MagOilInterface
+from components.interfaces import magoil_store
+from components.responses import FastJSONResponse
+from routes.front_interaction import view_cache
 from models.documents import MagOilReport
 
 from datetime import date
@@ -19,11 +23,14 @@ async def about_section():
     return {"message": "Hello, You are in Documents section."}
 
 
-@router.put("/api/documents/income_docs/upload_xlsx")
+@router.put("/api/documents/income_docs/upload_xlsx", status_code=202)
 async def income_docs_upload_xlsx(file: UploadFile):
     """
     Загружает файл с информацией о рейсах и их путевых листах и ТН.
+    Принимаются файлы xlsx, csv (UTF-8, разделитель "," или ";", даты дд.мм.гггг) и parquet.
     В файле должны быть столбцы: ИД Рейса, ПЛ, ТН
+    Необязательные столбцы: Вес_погрузка, Вес_выгрузка, Дата отправления, Дата прибытия - если есть хотя бы один
+    из них, нужны все, и по ним будут изменены рейсы.
 
     По данным в файле будут созданы записи о документах ПЛ и ТН.
 
@@ -31,32 +38,41 @@ async def income_docs_upload_xlsx(file: UploadFile):
 
     - file (UploadFile): The file to be uploaded.
 
+    Документы и веса рейсов записываются в одной транзакции: при ошибке в данных не записывается ничего.
+
+    Файл обрабатывается в фоне, повторная загрузка того же файла во время обработки возвращает уже запущенную задачу.
+
     Returns (any):
 
-    - List[int|str]: The list of The ID's of the inserted data or strings of errors.
+    - JSON: The job (202), see /api/jobs/{job_id}; its result is a dict: "documents" - True or the error message
+    for every document, "runs" - True (updated), False (nothing changed) or the error message for every run.
     """
-    try:
-        documents_runs = IncomeDocsDF(file)
-        documents_runs.MAX_FILE_SIZE = 15 * 1024  # 15kB
+    IncomeDocsDF(file).check_file(file)
+
+    async def work(job, upload):
+        job.progress = "parsing"
+        documents_runs = IncomeDocsDF(upload)
+        # raw_df is parsed again by RunsDFWeight below
+        documents_runs.columns += RunsDFWeight.COLUMNS
         documents_items = await documents_runs.objects_list
-        result = await post_multiple_objects(documents_items, "runs_documents")
-        try:
-            conditions = ('id',)
-            runs = RunsDFWeight(documents_runs.raw_df)
-            runs_items = await runs.objects_list
-            await put_multiple_objects(runs_items, "runs", conditions)
-        except HTTPException as e:
-            return e
-    except HTTPException as e:
-        return e
-    return result
-
-
-@router.put("/api/documents/outcome_docs/upload_xlsx")
+        # the weight columns are optional: a file of documents only leaves the runs as they are
+        runs_items = await RunsDFWeight(documents_runs.raw_df).objects_list \
+            if RunsDFWeight.in_frame(documents_runs.raw_df) else []
+        job.progress = f"writing {len(documents_items)} documents, {len(runs_items)} runs"
+        result = await run_in_threadpool(ingest_documents, documents_items, runs_items, ('id',))
+        view_cache.invalidate("runs_view")
+        return result
+    return JobManager.accepted(await jobs.submit_upload("income_docs", file, work))
+
+
+@router.put("/api/documents/outcome_docs/upload_xlsx", status_code=202)
 async def outcome_docs_upload_xlsx(file: UploadFile):
     """
     Загружает файл с информацией о документах Заказчику и от Поставщика.
+    Принимаются файлы xlsx, csv (UTF-8, разделитель "," или ";", даты дд.мм.гггг) и parquet.
     В файле должны быть столбцы: ИД Рейса, УПД Поставщика, Реестр Заказчику, УПД Заказчику.
+    Необязательные столбцы: Вес_погрузка_клиент, Вес_выгрузка_клиент - если есть хотя бы один из них, нужны оба,
+    и по ним будут изменены рейсы.
 
     По данным в файле будут созданы записи о документах УПД Поставщика, Реестр Заказчику, УПД Заказчику.
 
@@ -65,25 +81,31 @@ async def outcome_docs_upload_xlsx(file: UploadFile):
 
     - file (UploadFile): The file to be uploaded.
 
+    Документы и веса рейсов записываются в одной транзакции: при ошибке в данных не записывается ничего.
+
+    Файл обрабатывается в фоне, повторная загрузка того же файла во время обработки возвращает уже запущенную задачу.
+
     Returns (any):
 
-    - List[int|str]: The list of The ID's of the inserted data or strings of errors.
+    - JSON: The job (202), see /api/jobs/{job_id}; its result is a dict: "documents" - True or the error message
+    for every document, "runs" - True (updated), False (nothing changed) or the error message for every run.
     """
-    try:
-        documents_runs = ClientDocsDF(file)
-        documents_runs.MAX_FILE_SIZE = 15 * 1024  # 15kB
+    ClientDocsDF(file).check_file(file)
+
+    async def work(job, upload):
+        job.progress = "parsing"
+        documents_runs = ClientDocsDF(upload)
+        # raw_df is parsed again by RunsDFClientWeight below
+        documents_runs.columns += RunsDFClientWeight.COLUMNS
         documents_items = await documents_runs.objects_list
-        result = await post_multiple_objects(documents_items, "runs_documents")
-        try:
-            conditions = ('id',)
-            runs = RunsDFClientWeight(documents_runs.raw_df)
-            runs_items = await runs.objects_list
-            await put_multiple_objects(runs_items, "runs", conditions)
-        except HTTPException as e:
-            return e
-    except HTTPException as e:
-        return e
-    return result
+        # the weight columns are optional: a file of documents only leaves the runs as they are
+        runs_items = await RunsDFClientWeight(documents_runs.raw_df).objects_list \
+            if RunsDFClientWeight.in_frame(documents_runs.raw_df) else []
+        job.progress = f"writing {len(documents_items)} documents, {len(runs_items)} runs"
+        result = await run_in_threadpool(ingest_documents, documents_items, runs_items, ('id',))
+        view_cache.invalidate("runs_view")
+        return result
+    return JobManager.accepted(await jobs.submit_upload("outcome_docs", file, work))
 
 
 @router.get("/api/documents/get_trn")
@@ -95,7 +117,7 @@ async def get_trn(run_id: int, doc_name: str):
     """
     tn = TN(run_id, doc_name)
     if await tn.get_data():
-        tn.fill_pdf()
+        await run_in_threadpool(tn.fill_pdf)
         content = tn.get_pdf()
         return Response(content, media_type="application/pdf")
 
@@ -109,17 +131,46 @@ async def get_trn(run_id: int, doc_name: str):
     """
     tn = TN(run_id, doc_name)
     if await tn.get_data():
-        tn.fill_pdf()
+        await run_in_threadpool(tn.fill_pdf)
         content = tn.get_pdf()
         return Response(content, media_type="application/pdf")
 
 
+@router.get("/api/documents/get_trn_batch")
+async def get_trn_batch(run_ids: Optional[List[int]] = Query(None), start_day: Optional[date] = None,
+                        end_day: Optional[date] = None):
+    """
+    Возвращает ZIP-архив документов ТН в формате pdf для списка рейсов или для рейсов за период.
+    Документы заполняются параллельно в нескольких процессах, архив передается по мере готовности документов.
+    Каждый документ называется по номеру ТН рейса, файлы в архиве - по ИД рейса: {run_id}.pdf.
+
+    Args (necessary any):
+
+    - run_ids (List[int]): The IDs of the runs.
+    - start_day, end_day (date): The departure date range of the runs, used if run_ids is not given.
+
+    Returns:
+
+    - ZIP file of PDF documents.
+    """
+    if not run_ids and not (start_day and end_day):
+        raise HTTPException(status_code=400, detail="Укажите run_ids или start_day и end_day")
+    documents = await TN.get_many(run_ids, start_day, end_day)
+    if not documents:
+        raise HTTPException(status_code=404, detail="Runs not found.")
+    return StreamingResponse(TN.zip_stream(documents), media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="tn.zip"'})
+
+
 @router.get("/api/documents/magoil_report")
 async def get_magoil_report(start_date: Optional[date] = None, end_date: Optional[date] = None):
     """
     Возвращает сгенерированный отчет Продхимпром в формате dict.
+    Отчет строится по локальной копии транзакций MagOil: дни, которых в ней нет, и текущий день загружаются перед
+    ответом. Прошлые дни обновляет планировщик, поздние транзакции за них могут появиться в отчете с задержкой
+    до 15 минут; дни старше 62 дней удаляются из копии и загружаются заново при запросе.
     """
     data = {"start_date": start_date or date.today().replace(day=1),
             "end_date": end_date or date.today()}
-    result = MagOilInterface(MagOilReport(**data)).get_json()
-    return JSONResponse(content=result)
+    result = await magoil_store.get_json(MagOilReport(**data))
+    return FastJSONResponse(content=result)
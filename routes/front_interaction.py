@@ -1,13 +1,18 @@
 from datetime import date
-from fastapi import APIRouter, UploadFile, HTTPException
+from fastapi import APIRouter, UploadFile, Request, Response
 from fastapi.responses import JSONResponse
 from database import sql_handler
+from database.sync import SyncOrchestrator
 from models.front_interaction import Car, Person, Invoice, DriverPlace, Run
 from psycopg2 import sql
 from typing import List, Optional
 import components.func as func
 from components.datafiles import DriverPlacesDF
+from components.cache import ViewCache
+from components.responses import FastJSONResponse, NDJSONResponse
 from components.func import post_multiple_objects, put_multiple_objects
+from components.jobs import jobs, JobManager
+from fastapi.concurrency import run_in_threadpool
 
 router = APIRouter()
 
@@ -17,8 +22,32 @@ TABLES = {"persons": ("_reference300", "_reference155", "_reference89", "_inforg
           "invoices": ("_document350", "_document350_vt1855", "_document365_vt2454", "_reference124", "_reference207",
                        "_reference207_vt7419", "_reference225", "_reference111", "_reference110", "_reference128",
                        "_document350_vt1893", "_reference88")}
-STATIC_VIEWS = {"persons", "cars", "cargo", "routes", "counterparty", "invoices", "react_drivers", "react_cars",
-                "runs_view"}
+# groups of TABLES that must be committed before the given group is synced; none today, the groups copy
+# unrelated 1C tables and the views read them only after all of them are synced
+SYNC_DEPENDENCIES = {}
+# reference views, small and read often; the date range lists (runs_view, drivers_place) are only versioned
+STATIC_VIEWS = {"persons", "cars", "cargo", "routes", "counterparty", "invoices", "react_drivers", "react_cars"}
+# views built on the tables of every TABLES group; runs_view and drivers_place also change with the API writes
+SYNC_VIEWS = {"persons": ("persons", "react_drivers", "runs_view", "drivers_place"),
+              "cars": ("cars", "react_cars", "runs_view", "drivers_place"),
+              "invoices": ("invoices", "cargo", "routes", "counterparty", "runs_view")}
+view_cache = ViewCache(STATIC_VIEWS, versioned={view for views in SYNC_VIEWS.values() for view in views})
+# keyset pagination keys of the date range lists
+RUNS_KEY = ("date_departure", "id")
+DRIVERS_PLACE_KEY = ("date_place", "id")
+
+
+def on_table_synced(table: Optional[str]):
+    """
+    Invalidates the cached views built on a 1C table when its sync is committed.
+    None means that sync notifications may have been missed, so every view is invalidated.
+    """
+    if table is None:
+        view_cache.invalidate()
+        return
+    views = {view for group, tables in TABLES.items() if table in tables for view in SYNC_VIEWS[group]}
+    if views:
+        view_cache.invalidate(*views)
 
 
 @router.get("/")
@@ -29,33 +58,49 @@ async def root():
     return {"message": "Hello World"}
 
 
-@router.patch("/api/update_data/{data}")
-def update_data(data: str):
+@router.patch("/api/update_data/{data}", status_code=202)
+async def update_data(data: str, full: bool = False):
     """
-    Синхронизирует данные из таблиц 1С в БД Cars
+    Запускает синхронизацию данных из таблиц 1С в БД Cars в фоне.
+    Повторный запрос для той же таблицы во время синхронизации возвращает уже запущенную задачу; запрос
+    полной синхронизации делает полной еще не начавшуюся задачу.
+    Таблицы группы синхронизируются по очереди в одной транзакции; параллельно, по группам, работает только
+    синхронизация всех групп в планировщике.
 
     Args:
 
     - data (str): The name of the table to update Can be: 'persons', 'cars', 'invoices'.
+    - full (bool): Copy the whole 1C tables instead of the rows changed since the last sync.
 
     Returns:
 
-    - JSON: A message indicating the status of the update.
+    - JSON: The job (202), see /api/jobs/{job_id}; its result is the sync report with the duration of every table.
     """
     _data = str(data).lower()
-    if _data in TABLES:
-        for table in TABLES[_data]:
-            with sql_handler.CarsTable(table) as _obj:
-                _obj.sync()
-        return JSONResponse(status_code=200, content={"message": f"{_data} updated"})
-    else:
+    if _data not in TABLES:
         return JSONResponse(status_code=400, content={"message": f"Can not update {_data}"})
 
+    async def work(job):
+        job.progress = f"syncing {_data}"
+        report = await run_in_threadpool(SyncOrchestrator(TABLES, SYNC_DEPENDENCIES).run, [_data],
+                                         job.options["full"])
+        job.result = report
+        if any(group["status"] != "ok" for group in report.values()):
+            raise RuntimeError(f"Can not update {_data}")
+        return report
+    # one sync of a group at a time, whatever its mode: both use the same watermark and temp tables
+    job = jobs.submit("update_data", _data, work, options={"full": full})
+    if full and job.status == "queued":
+        # a queued incremental sync becomes a full one, a running sync is not restarted
+        job.options["full"] = True
+    return JobManager.accepted(job)
+
 
 @router.get("/api/cars", response_model=List[Car])
-async def get_cars():
+async def get_cars(request: Request, response: Response):
     """
     Возвращает список машин.
+    Ответ содержит ETag; при совпадении с заголовком If-None-Match возвращается 304 Not Modified.
 
     Args: None
 
@@ -65,7 +110,10 @@ async def get_cars():
     """
     view = "cars"
     cl = Car
-    return await func.get_view_data(view, cl)
+    not_modified = func.not_modified(request, response, view_cache.etag(view))
+    if not_modified:
+        return not_modified
+    return FastJSONResponse(await func.get_view_data(view, cl, cache=view_cache) or [], headers=response.headers)
 
 
 @router.get("/api/car_by_id", response_model=Optional[Car])
@@ -83,15 +131,16 @@ async def get_car(car_id: int):
     cl = Car
     car_id = car_id if isinstance(car_id, int) else None
     if car_id:
-        where = sql.SQL(" WHERE id = {car_id}").format(car_id=sql.Literal(car_id))
-        result = await func.get_view_data(view, cl, where)
+        where = sql.SQL(" WHERE id = {car_id}").format(car_id=sql.Placeholder())
+        result = await func.get_view_data(view, cl, where, (car_id,), cache=view_cache)
         return result[0]
 
 
 @router.get("/api/drivers", response_model=List[Person])
-async def get_drivers():
+async def get_drivers(request: Request, response: Response):
     """
     Возвращает список водителей.
+    Ответ содержит ETag; при совпадении с заголовком If-None-Match возвращается 304 Not Modified.
 
     Args: None
 
@@ -101,8 +150,12 @@ async def get_drivers():
     """
     view = "persons"
     cl = Person
-    where = sql.SQL("where position = {} or position is null").format(sql.Literal('Водитель-экспедитор'))
-    return await func.get_view_data(view, cl, where)
+    not_modified = func.not_modified(request, response, view_cache.etag(view))
+    if not_modified:
+        return not_modified
+    where = sql.SQL("where position = {} or position is null").format(sql.Placeholder())
+    result = await func.get_view_data(view, cl, where, ('Водитель-экспедитор',), cache=view_cache)
+    return FastJSONResponse(result or [], headers=response.headers)
 
 
 @router.get("/api/driver_by_id", response_model=Optional[Person])
@@ -120,15 +173,16 @@ async def get_driver(driver_id: int):
     cl = Person
     driver_id = driver_id if isinstance(driver_id, int) else None
     if driver_id:
-        where = sql.SQL(" WHERE id = {driver_id}").format(driver_id=sql.Literal(driver_id))
-        result = await func.get_view_data(view, cl, where)
+        where = sql.SQL(" WHERE id = {driver_id}").format(driver_id=sql.Placeholder())
+        result = await func.get_view_data(view, cl, where, (driver_id,), cache=view_cache)
         return result[0]
 
 
 @router.get("/api/invoices", response_model=Optional[List[Invoice]])
-async def get_invoices(day: Optional[date] = None):
+async def get_invoices(request: Request, response: Response, day: Optional[date] = None):
     """
     Возвращает список Заявок на перевозку, актуальных на дату запроса.
+    Ответ содержит ETag; при совпадении с заголовком If-None-Match возвращается 304 Not Modified.
 
     Args:
 
@@ -141,16 +195,21 @@ async def get_invoices(day: Optional[date] = None):
     view = "invoices"
     cl = Invoice
     day = day or date.today()
+    # the default day changes at midnight without any invalidation
+    not_modified = func.not_modified(request, response, view_cache.etag(view, day.isoformat()))
+    if not_modified:
+        return not_modified
     where = (
         sql.SQL(" WHERE {day} between {departure_date} and {arrival_date}").format(
             departure_date=sql.Identifier("departure_date"),
             arrival_date=sql.Identifier("arrival_date"),
-            day=sql.Literal(day.strftime("%Y-%m-%d")),
+            day=sql.Placeholder(),
         )
         if day
         else None
     )
-    return await func.get_view_data(view, cl, where)
+    result = await func.get_view_data(view, cl, where, (day,), cache=view_cache)
+    return FastJSONResponse(result or [], headers=response.headers)
 
 
 @router.get("/api/invoice_by_id", response_model=Optional[Invoice])
@@ -170,32 +229,53 @@ async def get_invoice(invoice_id: int):
     cl = Invoice
     invoice_id = invoice_id if isinstance(invoice_id, int) else None
     if invoice_id:
-        where = sql.SQL(" WHERE id = {invoice_id}").format(invoice_id=sql.Literal(invoice_id))
-        result = await func.get_view_data(view, cl, where)
+        where = sql.SQL(" WHERE id = {invoice_id}").format(invoice_id=sql.Placeholder())
+        result = await func.get_view_data(view, cl, where, (invoice_id,), cache=view_cache)
         return result[0]
 
 
 @router.get("/api/drivers_place", response_model=Optional[List[DriverPlace]])
-async def get_drivers_place(start_day: date, end_day: date):
+async def get_drivers_place(request: Request, response: Response, start_day: date, end_day: date,
+                            limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
     """
-    Возвращает расстановку водителей на машины для всех дат, указанных в запросе.
+    Возвращает расстановку водителей на машины для всех дат, указанных в запросе, упорядоченную по дате и ИД.
+    Ответ содержит ETag; при совпадении с заголовком If-None-Match возвращается 304 Not Modified.
+    С параметром limit возвращается страница записей, курсор следующей страницы передается в заголовке
+    X-Next-Cursor (нет заголовка - последняя страница).
 
     Args:
 
     - start_day (date): The start date of the range.
     - end_day (date): The end date of the range.
 
+    Args (optional any):
+
+    - limit (int): The page size.
+    - cursor (str): The X-Next-Cursor header of the previous page.
+    - stream (bool): Stream all the records as NDJSON (application/x-ndjson), one object per line.
+
     Returns:
 
     - List[DriverPlace]: A list of DriverPlace objects.
     """
     view = "drivers_place"
     cl = DriverPlace
+    not_modified = func.not_modified(request, response, view_cache.etag(view))
+    if not_modified:
+        return not_modified
     where = sql.SQL("WHERE date_place between {start_date} and {end_date}").format(
-        start_date=sql.Literal(start_day.strftime("%Y-%m-%d")),
-        end_date=sql.Literal(end_day.strftime("%Y-%m-%d")),
+        start_date=sql.Placeholder(),
+        end_date=sql.Placeholder(),
     )
-    return await func.get_view_data(view, cl, where)
+    if stream:
+        where, params = func.keyset_page(where, (start_day, end_day), DRIVERS_PLACE_KEY)
+        return NDJSONResponse(func.stream_view_data(view, cl, where, params), headers=response.headers)
+    where, params = func.keyset_page(where, (start_day, end_day), DRIVERS_PLACE_KEY, limit, cursor)
+    result = await func.get_view_data(view, cl, where, params)
+    next_cursor = func.next_cursor(result, DRIVERS_PLACE_KEY, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return FastJSONResponse(result or [], headers=response.headers)
 
 
 @router.post("/api/drivers_place")
@@ -218,15 +298,18 @@ def set_drivers_place(data: DriverPlace) -> str | int:
     columns_data = dict(zip(columns, [data.date_place, data.driver_id, data.car_id]))
     with sql_handler.CarsTable("drivers_place_table") as _obj:
         result = _obj.insert_data(columns_data)
+    view_cache.invalidate("drivers_place")
     return result if isinstance(result, str) else result[0]["lastrowid"][0]
 
 
-@router.post('/api/drivers_place/upload_xlsx')
+@router.post('/api/drivers_place/upload_xlsx', status_code=202)
 async def post_driver_places_upload_xlsx(file: UploadFile):
     """
     Загружает файл с расстановкой водителей на машины. В файле должны быть столбцы: Дата, ИД Водителя, ИД Машины.
+    Принимаются файлы xlsx, csv (UTF-8, разделитель "," или ";", даты дд.мм.гггг) и parquet.
     Дополнительные столбцы допускаются, но не обрабатываются.
-    По данным в файле будут созданы новые записи.
+    По данным в файле будут созданы новые записи. Файл обрабатывается в фоне, повторная загрузка того же файла
+    во время обработки возвращает уже запущенную задачу.
 
     Args (necessary all):
 
@@ -234,16 +317,21 @@ async def post_driver_places_upload_xlsx(file: UploadFile):
 
     Returns (any):
 
-    - List[int|str]: The list of The ID's of the inserted data or strings of errors.
+    - JSON: The job (202), see /api/jobs/{job_id}; its result is the list of The ID's of the inserted data
+    or strings of errors.
     """
-    try:
-        places = DriverPlacesDF(file, method='POST')
-        places.MAX_FILE_SIZE = 15 * 1024  # 15kB
+    DriverPlacesDF(file, method='POST').check_file(file)
+
+    async def work(job, upload):
+        job.progress = "parsing"
+        places = DriverPlacesDF(upload, method='POST')
         places_items = await places.objects_list
-        result = await post_multiple_objects(places_items, "drivers_place_table")
-    except HTTPException as e:
-        return e
-    return result
+        job.progress = f"inserting {len(places_items)} rows"
+        try:
+            return await post_multiple_objects(places_items, "drivers_place_table")
+        finally:
+            view_cache.invalidate("drivers_place")
+    return JobManager.accepted(await jobs.submit_upload("drivers_place_post", file, work))
 
 
 @router.put("/api/drivers_place")
@@ -270,17 +358,20 @@ async def put_drivers_place(data: DriverPlace) -> str | bool:
     condition_columns = ("id",)
     columns_data = dict(zip(columns, [data.date_place, data.driver_id, data.car_id]))
     condition_data = dict(zip(condition_columns, [data.id, ]))
-    with sql_handler.CarsTable("drivers_place_table") as _obj:
-        result = _obj.update_data(columns_data, condition_data)
+    async with sql_handler.AsyncCarsTable("drivers_place_table") as _obj:
+        result = await _obj.update_data(columns_data, condition_data)
+    view_cache.invalidate("drivers_place")
     return True if isinstance(result, list) else result
 
 
-@router.put('/api/drivers_place/upload_xlsx')
+@router.put('/api/drivers_place/upload_xlsx', status_code=202)
 async def put_driver_places_upload_xlsx(file: UploadFile):
     """
     Загружает файл с расстановкой водителей на машины. В файле должны быть столбцы: ID, Дата, Водитель, Машина.
+    Принимаются файлы xlsx, csv (UTF-8, разделитель "," или ";", даты дд.мм.гггг) и parquet.
     По данным в файле будут изменены записи с соответствующим ID на данные из файла.
-    Максимальный размер файла для загрузки - 15 кБ
+    Максимальный размер файла для загрузки - 20 МБ. Файл обрабатывается в фоне, повторная загрузка того же файла
+    во время обработки возвращает уже запущенную задачу.
 
     Args (necessary all):
 
@@ -288,17 +379,22 @@ async def put_driver_places_upload_xlsx(file: UploadFile):
 
     Returns (any):
 
-    - List[int|str]: The list of The ID's of the inserted data or strings of errors.
+    - JSON: The job (202), see /api/jobs/{job_id}; its result is the list of True, False or strings of errors
+    for every row.
     """
     conditions = ('id',)
-    try:
-        places = DriverPlacesDF(file, method='PUT')
-        places.MAX_FILE_SIZE = 15 * 1024  # 15kB
+    DriverPlacesDF(file, method='PUT').check_file(file)
+
+    async def work(job, upload):
+        job.progress = "parsing"
+        places = DriverPlacesDF(upload, method='PUT')
         places_items = await places.objects_list
-        result = await put_multiple_objects(places_items, "drivers_place_table", conditions)
-    except HTTPException as e:
-        return e
-    return result
+        job.progress = f"updating {len(places_items)} rows"
+        try:
+            return await put_multiple_objects(places_items, "drivers_place_table", conditions)
+        finally:
+            view_cache.invalidate("drivers_place")
+    return JobManager.accepted(await jobs.submit_upload("drivers_place_put", file, work))
 
 
 @router.delete("/api/drivers_place")
@@ -316,33 +412,54 @@ async def delete_drivers_place(data: int) -> str | bool:
     """
     condition_columns = ("id",)
     condition_data = dict(zip(condition_columns, [data, ]))
-    with sql_handler.CarsTable("drivers_place_table") as _obj:
-        result = _obj.delete_data(condition_data)
+    async with sql_handler.AsyncCarsTable("drivers_place_table") as _obj:
+        result = await _obj.delete_data(condition_data)
+    view_cache.invalidate("drivers_place")
     return result if isinstance(result, str) else bool(result[0]["rowcount"])
 
 
 @router.get("/api/runs", response_model=Optional[List[Run]])
-async def get_runs(start_day: date, end_day: date):
+async def get_runs(request: Request, response: Response, start_day: date, end_day: date,
+                   limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
     """
-    Возвращает список рейсов автомобилей для всех дат, указанных в запросе.
+    Возвращает список рейсов автомобилей для всех дат, указанных в запросе, упорядоченный по дате и ИД.
+    Ответ содержит ETag; при совпадении с заголовком If-None-Match возвращается 304 Not Modified.
+    С параметром limit возвращается страница рейсов, курсор следующей страницы передается в заголовке
+    X-Next-Cursor (нет заголовка - последняя страница).
 
     Args (necessary all):
 
     - start_day (date): The start date of the range.
     - end_day (date): The end date of the range.
 
+    Args (optional any):
+
+    - limit (int): The page size.
+    - cursor (str): The X-Next-Cursor header of the previous page.
+    - stream (bool): Stream all the runs as NDJSON (application/x-ndjson), one object per line.
+
     Returns (any):
 
     - List[Run]: A list of Run objects.
     """
     view = "runs_view"
     cl = Run
+    not_modified = func.not_modified(request, response, view_cache.etag(view))
+    if not_modified:
+        return not_modified
     where = sql.SQL("WHERE date_departure between {start_date} and {end_date}").format(
-        start_date=sql.Literal(start_day.strftime("%Y-%m-%d")),
-        end_date=sql.Literal(end_day.strftime("%Y-%m-%d")),
+        start_date=sql.Placeholder(),
+        end_date=sql.Placeholder(),
     )
-    result = await func.get_view_data(view, cl, where)
-    return result
+    if stream:
+        where, params = func.keyset_page(where, (start_day, end_day), RUNS_KEY)
+        return NDJSONResponse(func.stream_view_data(view, cl, where, params), headers=response.headers)
+    where, params = func.keyset_page(where, (start_day, end_day), RUNS_KEY, limit, cursor)
+    result = await func.get_view_data(view, cl, where, params, cache=view_cache)
+    next_cursor = func.next_cursor(result, RUNS_KEY, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return FastJSONResponse(result or [], headers=response.headers)
 
 
 @router.get("/api/run_by_id", response_model=Optional[Run])
@@ -360,8 +477,8 @@ async def get_run(run_id: int):
     """
     view = "runs_view"
     cl = Run
-    where = sql.SQL(" WHERE id = {run_id}").format(run_id=sql.Literal(run_id))
-    result = await func.get_view_data(view, cl, where)
+    where = sql.SQL(" WHERE id = {run_id}").format(run_id=sql.Placeholder())
+    result = await func.get_view_data(view, cl, where, (run_id,), cache=view_cache)
     return result[0]
 
 
@@ -387,17 +504,18 @@ async def post_runs(data: Run) -> str | int | List[str | int]:
     """
     columns = ("weight", "date_departure", "car_id", "invoice_id")
     columns_data = dict(zip(columns, [data.weight, data.date_departure, data.car_id, data.invoice_id]))
-    with sql_handler.CarsTable("runs") as _obj:
+    async with sql_handler.AsyncCarsTable("runs") as _obj:
         if isinstance(data.car_id, list):
             result = []
             for car_id in data.car_id:
                 columns_data["car_id"] = car_id
-                _result = _obj.insert_data(columns_data)
+                _result = await _obj.insert_data(columns_data)
                 result.append(_result if isinstance(_result, str) else _result[0]["lastrowid"][0])
-            return result
         else:
-            result = _obj.insert_data(columns_data)
-            return result if isinstance(result, str) else result[0]["lastrowid"][0]
+            result = await _obj.insert_data(columns_data)
+            result = result if isinstance(result, str) else result[0]["lastrowid"][0]
+    view_cache.invalidate("runs_view")
+    return result
 
 
 @router.put("/api/runs")
@@ -436,8 +554,9 @@ async def put_runs(data: Run):
                                       data.waybill, data.invoice_document, data.date_arrival, data.reg_number,
                                       data.reg_date, data.acc_number, data.acc_date]))
     condition_data = dict(zip(condition_columns, [data.id, ]))
-    with sql_handler.CarsTable("runs") as _obj:
-        result = _obj.update_data(columns_data, condition_data)
+    async with sql_handler.AsyncCarsTable("runs") as _obj:
+        result = await _obj.update_data(columns_data, condition_data)
+    view_cache.invalidate("runs_view")
     return True if isinstance(result, list) else result
 
 
@@ -507,7 +626,8 @@ async def delete_runs(data: int):
     """
     condition_columns = ("id",)
     condition_data = dict(zip(condition_columns, [data, ]))
-    _obj = sql_handler.CarsTable("runs")
-    with _obj:
-        result = _obj.delete_data(condition_data)
+    _obj = sql_handler.AsyncCarsTable("runs")
+    async with _obj:
+        result = await _obj.delete_data(condition_data)
+    view_cache.invalidate("runs_view")
     return result if isinstance(result, str) else bool(result[0]["rowcount"])
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, HTTPException
+
+from components.jobs import jobs
+
+router = APIRouter()
+
+
+@router.get("/api/jobs")
+async def get_jobs():
+    """
+    Возвращает список фоновых задач (загрузки файлов, синхронизация с 1С) текущего процесса.
+
+    Returns:
+
+    - List[dict]: The jobs, see /api/jobs/{job_id}.
+    """
+    return [job.as_dict() for job in jobs.jobs()]
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Возвращает состояние фоновой задачи.
+
+    Args:
+
+    - job_id (str): The job ID returned by the endpoint that started the job.
+
+    Returns:
+
+    - dict: status ("queued", "running", "done", "failed"), progress, creation, start and finish timestamps,
+    duration in seconds, result (the per-row results of an upload, the report of a sync) and error.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.as_dict()
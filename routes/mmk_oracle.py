@@ -20,13 +20,13 @@ async def about_section():
 async def get_certificate_empty() -> List[date]:
     """Get dates of invoices where certificates have no Yandex disk link.
     It means that the certificate has not downloads from MMK yet."""
-    _obj = sql_handler.CarsTable("mmk_oracle_certificate")
+    _obj = sql_handler.AsyncCarsTable("mmk_oracle_certificate")
     query = sql.SQL(
         "select distinct i.invoice_date from mmk_oracle_certificate c join mmk_oracle_invoices i "
         "on c.invoice_number = i.invoice_number where c.link is null order by i.invoice_date;"
     )
-    with _obj:
-        result = _obj.dql_handler(query)
+    async with _obj:
+        result = await _obj.dql_handler(query)
     result = list([i[0] for i in result[0]])
     return result
 
@@ -0,0 +1,65 @@
+from typing import Optional
+
+from fastapi import APIRouter
+
+from database.sql_handler import DataBase, AsyncDataBase, SchemaCache
+from routes.front_interaction import view_cache
+from components.fill_template import PdfFile
+
+router = APIRouter()
+
+
+@router.get("/api/service/pool_stats")
+async def get_pool_stats():
+    """
+    Возвращает состояние пулов соединений с БД текущего процесса.
+
+    Returns:
+
+    - dict: For the sync (psycopg2) and the async (aiopg) pools of every database ("cars", "db1c"):
+    pool size limits, idle and borrowed connections; sync pools also count borrowed, created and discarded
+    connections, waits and timeouts.
+    """
+    return {"sync": DataBase.pool_stats(), "async": AsyncDataBase.pool_stats()}
+
+
+@router.get("/api/service/schema_cache")
+async def get_schema_cache_stats():
+    """
+    Возвращает состояние кэша метаданных таблиц (столбцы, первичный ключ) текущего процесса.
+    """
+    return SchemaCache.stats()
+
+
+@router.post("/api/service/schema_cache/invalidate")
+async def invalidate_schema_cache(database: Optional[str] = None, table: Optional[str] = None):
+    """
+    Сбрасывает кэш метаданных таблиц после изменения схемы БД.
+
+    Args (optional any):
+
+    - database (str): "cars" or "db1c"; all databases if not given.
+    - table (str): The table name; all tables if not given.
+
+    Returns:
+
+    - dict: The cache state after invalidation.
+    """
+    SchemaCache.invalidate(database, table)
+    return SchemaCache.stats()
+
+
+@router.get("/api/service/view_cache")
+async def get_view_cache_stats():
+    """
+    Возвращает состояние кэша справочных представлений (STATIC_VIEWS) текущего процесса.
+    """
+    return view_cache.stats()
+
+
+@router.get("/api/service/pdf_cache")
+async def get_pdf_cache_stats():
+    """
+    Возвращает состояние кэша сгенерированных документов pdf текущего процесса.
+    """
+    return PdfFile.CACHE.stats()
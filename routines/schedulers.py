@@ -1,6 +1,10 @@
 # This file contains the schedulers for the application
 
+import asyncio
+
 from routes import front_interaction
+from components.interfaces import MagOilInterface, MagOilStore
+from database.sync import SyncOrchestrator
 from components.logger_config import configure_logger
 import logging
 
@@ -9,6 +13,24 @@ configure_logger()
 
 def update_from_db1c():
     logging.info(f"update_from_db1c started")
-    for table in front_interaction.TABLES.keys():
-        front_interaction.update_data(table)
-        logging.info(f"{table} updated")
+    orchestrator = SyncOrchestrator(front_interaction.TABLES, front_interaction.SYNC_DEPENDENCIES)
+    for group, result in orchestrator.run().items():
+        logging.info(f"{group} {result['status']} in {result.get('duration', 0)} s: {result.get('error', '')}")
+
+
+def refresh_magoil():
+    logging.info("refresh_magoil started")
+
+    async def refresh():
+        # a client of its own: the shared one belongs to the event loop of the API process
+        interface = MagOilInterface()
+        try:
+            return await MagOilStore(interface).refresh()
+        finally:
+            await interface.close()
+    try:
+        days = asyncio.run(refresh())
+        dropped = MagOilStore.prune()
+        logging.info(f"refresh_magoil loaded {len(days)} days, {sum(days.values())} rows, dropped {len(dropped)} days")
+    except Exception as e:
+        logging.exception(f"refresh_magoil failed: {e}")
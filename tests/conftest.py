@@ -0,0 +1,62 @@
+import os
+
+import psycopg2
+import pytest
+
+from database.sql_handler import DataBase, SchemaCache
+
+# the tables the tests write to, reduced to the columns the code under test uses
+SCHEMA = """
+drop schema if exists public cascade;
+create schema public;
+create table runs (id serial primary key, date_departure date, date_arrival date, weight numeric,
+                   weight_arrival numeric, client_weight numeric, client_weight_arrival numeric);
+create table runs_documents (id serial primary key, name text not null, run_id int not null references runs (id),
+                             doc_type int not null, unique (name, doc_type));
+"""
+
+
+@pytest.fixture(scope="session")
+def pg_dsn(tmp_path_factory):
+    """A disposable Postgres: TEST_DATABASE_URL, or a local server started with pgserver when it is installed."""
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if dsn is None:
+        pgserver = pytest.importorskip("pgserver")
+        dsn = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop").get_uri()
+    return dsn
+
+
+@pytest.fixture
+def cars_db(pg_dsn):
+    """Points the "cars" database of DataBase to the test server, on an empty schema; yields an autocommit cursor."""
+    params = psycopg2.extensions.parse_dsn(pg_dsn)
+    credentials = DataBase._credentials
+    DataBase._credentials = {"cars": {"host": params.get("host"), "port": params.get("port", 5432),
+                                      "database": params.get("dbname"), "user": params.get("user"),
+                                      "password": params.get("password", "")}}
+    DataBase._pools, DataBase._pools_pid = {}, None
+    SchemaCache.invalidate()
+    conn = psycopg2.connect(pg_dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(SCHEMA)
+    yield cur
+    for pool in DataBase._pools.values():
+        for idle, _ in pool._idle:
+            idle.close()
+    DataBase._credentials, DataBase._pools, DataBase._pools_pid = credentials, {}, None
+    SchemaCache.invalidate()
+    conn.close()
+
+
+@pytest.fixture
+def db1c(cars_db, pg_dsn):
+    """Points the "db1c" database of DataBase to an empty database of the test server; yields an autocommit cursor."""
+    cars_db.execute("drop database if exists db1c with (force)")
+    cars_db.execute("create database db1c")
+    params = psycopg2.extensions.parse_dsn(pg_dsn)
+    DataBase._credentials["db1c"] = dict(DataBase._credentials["cars"], database="db1c")
+    conn = psycopg2.connect(**dict(params, dbname="db1c"))
+    conn.autocommit = True
+    yield conn.cursor()
+    conn.close()
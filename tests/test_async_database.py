@@ -0,0 +1,49 @@
+import asyncio
+
+import psycopg2
+import pytest
+from psycopg2 import pool
+
+from database.sql_handler import AsyncDataBase, DataBase
+
+
+@pytest.fixture
+def async_db(cars_db):
+    DataBase._credentials["cars"].update(pool_max_size=1, pool_timeout=0.2, query_timeout=0.5)
+    AsyncDataBase._async_pools, AsyncDataBase._async_pools_lock = {}, None
+    yield AsyncDataBase("cars")
+    AsyncDataBase._async_pools, AsyncDataBase._async_pools_lock = {}, None
+
+
+def test_waiting_for_a_connection_is_bounded_by_pool_timeout(async_db):
+    async def scenario():
+        conn = await async_db.open_connection()
+        try:
+            with pytest.raises(pool.PoolError):
+                await async_db.open_connection()
+        finally:
+            await async_db.close_connection(conn)
+            await AsyncDataBase.close_pools()
+
+    asyncio.run(scenario())
+
+
+def test_queries_are_bounded_by_query_timeout_only(async_db):
+    async def query(seconds: float):
+        conn = await async_db.open_connection()
+        try:
+            cur = await async_db.open_cursor(conn)
+            await cur.execute("select pg_sleep(%s)", (seconds,))
+        finally:
+            await async_db.close_connection(conn)
+
+    async def scenario():
+        try:
+            # longer than pool_timeout, shorter than query_timeout
+            await query(0.3)
+            with pytest.raises((asyncio.TimeoutError, psycopg2.Error)):
+                await query(1)
+        finally:
+            await AsyncDataBase.close_pools()
+
+    asyncio.run(scenario())
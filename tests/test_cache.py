@@ -0,0 +1,19 @@
+from components.cache import ViewCache
+
+
+def test_etag_changes_with_invalidation_and_variant():
+    cache = ViewCache({"invoices"})
+    etag = cache.etag("invoices", "2024-01-01")
+    assert cache.etag("invoices", "2024-01-02") != etag
+    cache.invalidate("invoices")
+    assert cache.etag("invoices", "2024-01-01") != etag
+
+
+def test_invalidate_all_covers_versioned_views():
+    cache = ViewCache({"cars"}, versioned={"drivers_place"})
+    cache.set("cars", "key", [1], cache.generation("cars"))
+    etags = cache.etag("cars"), cache.etag("drivers_place")
+    cache.invalidate()
+    assert cache.etag("cars") != etags[0]
+    assert cache.etag("drivers_place") != etags[1]
+    assert cache.get("cars", "key") == (False, None)
@@ -0,0 +1,38 @@
+import asyncio
+import io
+import threading
+from datetime import date
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from components.datafiles import DriverPlacesDF
+
+
+def upload(content: bytes, filename: str = "places.csv") -> UploadFile:
+    return UploadFile(io.BytesIO(content), size=len(content), filename=filename,
+                      headers=Headers({"content-type": "application/octet-stream"}))
+
+
+class RecordingPlacesDF(DriverPlacesDF):
+    """Records the threads cleaning and validating the file."""
+
+    def __init__(self, file: UploadFile):
+        super().__init__(file)
+        self.threads = []
+
+    def sanityze_df(self, df):
+        self.threads.append(threading.current_thread())
+        return super().sanityze_df(df)
+
+    def create_models_from_dataframe(self, model_class, df=None):
+        self.threads.append(threading.current_thread())
+        return super().create_models_from_dataframe(model_class, df)
+
+
+def test_upload_is_parsed_off_the_event_loop():
+    places = RecordingPlacesDF(upload("Дата;ИД Водителя;ИД Машины\n01.02.2024;5;7\n".encode()))
+    items = asyncio.run(places.objects_list)
+    assert [(item.date_place, item.driver_id, item.car_id) for item in items] == [(date(2024, 2, 1), 5, 7)]
+    assert len(places.threads) == 2
+    assert threading.main_thread() not in places.threads
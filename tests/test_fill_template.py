@@ -0,0 +1,29 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from components.fill_template import PdfTemplate
+
+TEMPLATE = "template_docs/tn.pdf"
+
+
+class CountingTemplate(PdfTemplate):
+    """Counts the parses of the template files."""
+    MAX_COPIES = 2
+    _copies = {}
+    _parsed = {}
+    _lock = threading.Lock()
+    parses = 0
+
+    def __init__(self, path: str):
+        type(self).parses += 1
+        super().__init__(path)
+
+
+def test_copies_are_bounded_and_filled_one_thread_at_a_time():
+    data = [{"name": f"ТН-{i}", "weight": i} for i in range(16)]
+    template = PdfTemplate(TEMPLATE)
+    expected = [template.fill(values) for values in data]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        contents = list(executor.map(lambda values: CountingTemplate.render(TEMPLATE, values), data))
+    assert contents == expected
+    assert CountingTemplate.parses <= CountingTemplate.MAX_COPIES
@@ -0,0 +1,34 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from database.sql_handler import AsyncDataBase
+from routes.front_interaction import router, view_cache
+
+
+def get(path: str, **params) -> httpx.Response:
+    app = FastAPI()
+    app.include_router(router)
+
+    async def scenario():
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                return await client.get(path, params=params)
+        finally:
+            await AsyncDataBase.close_pools()
+
+    AsyncDataBase._async_pools, AsyncDataBase._async_pools_lock = {}, None
+    view_cache.invalidate()
+    return asyncio.run(scenario())
+
+
+def test_no_rows_is_an_empty_list(cars_db):
+    cars_db.execute("create table cars (id serial primary key, description text, plate_number text, owner text, "
+                    "vin text, year float, engine_hp float, weight_capacity float, volume float, weight_own float, "
+                    "car_type text, car_model text, trailer_description text)")
+    response = get("/api/cars")
+    assert response.status_code == 200
+    assert response.json() == []
+    cars_db.execute("insert into cars (description) values ('КАМАЗ')")
+    assert [car["description"] for car in get("/api/cars").json()] == ["КАМАЗ"]
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+from components.func import ingest_documents
+from database.sql_handler import CarsTable
+from models.documents import Document
+from models.front_interaction import RunUpdaterWeight
+
+
+def add_runs(cur, count: int):
+    cur.execute("insert into runs (weight) select 10 from generate_series(1, %s)", (count,))
+
+
+def test_ingest_documents_and_runs(cars_db):
+    add_runs(cars_db, 2)
+    cars_db.execute("insert into runs_documents (name, run_id, doc_type) values ('ПЛ-1', 1, 1)")
+    documents = [Document("ПЛ-1", 1, 1), Document("ТН-1", 1, 2), Document("ТН-2", 99, 2), Document("ТН-3", 2, 2)]
+    runs = [RunUpdaterWeight(id=1, weight=Decimal("24.5")), RunUpdaterWeight(id=2, weight=Decimal(10)),
+            RunUpdaterWeight(id=99)]
+    result = ingest_documents(documents, runs, ("id",))
+    assert result["documents"] == [CarsTable.UNIQUE_VIOLATION_MESSAGE, True, CarsTable.FOREIGN_KEY_VIOLATION_MESSAGE,
+                                   True]
+    # run 2 keeps weight 10, the default weight_arrival 0 is written to both
+    assert result["runs"] == [True, True, CarsTable.MISSING_RECORD_MESSAGE]
+    cars_db.execute("select id, weight, weight_arrival from runs order by id")
+    assert cars_db.fetchall() == [(1, Decimal("24.5"), Decimal(0)), (2, Decimal(10), Decimal(0))]
+    cars_db.execute("select name, run_id from runs_documents order by id")
+    assert cars_db.fetchall() == [("ПЛ-1", 1), ("ТН-1", 1), ("ТН-3", 2)]
+
+
+def test_ingest_runs_without_documents(cars_db):
+    add_runs(cars_db, 1)
+    result = ingest_documents([], [RunUpdaterWeight(id=1, weight=Decimal(20))], ("id",))
+    assert result == {"documents": [], "runs": [True]}
+    cars_db.execute("select weight from runs")
+    assert cars_db.fetchall() == [(Decimal(20),)]
+
+
+def test_ingest_documents_without_runs(cars_db):
+    add_runs(cars_db, 1)
+    result = ingest_documents([Document("ТН-1", 1, 2)], [], ("id",))
+    assert result == {"documents": [True], "runs": []}
+    cars_db.execute("select count(*) from runs_documents")
+    assert cars_db.fetchall() == [(1,)]
+
+
+def test_ingest_nothing(cars_db):
+    assert ingest_documents([], [], ("id",)) == {"documents": [], "runs": []}
@@ -0,0 +1,46 @@
+import asyncio
+
+from fastapi import HTTPException
+
+from components.jobs import JobManager
+
+
+def test_submissions_are_coalesced_until_the_job_ends():
+    async def scenario():
+        manager = JobManager(max_workers=1)
+        started = asyncio.Event()
+
+        async def blocker(job):
+            started.set()
+            await asyncio.sleep(0.05)
+
+        async def work(job):
+            return job.options
+
+        running = manager.submit("sync", "other", blocker)
+        queued = manager.submit("sync", "cars", work, options={"full": False})
+        await started.wait()
+        assert manager.submit("sync", "cars", work, options={"full": True}) is queued
+        assert queued.status == "queued"
+        queued.options["full"] = True
+        await asyncio.sleep(0.1)
+        assert (running.status, queued.status, queued.result) == ("done", "done", {"full": True})
+        assert manager.submit("sync", "cars", work) is not queued
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_reports_the_error():
+    async def scenario():
+        manager = JobManager()
+
+        async def work(job):
+            raise HTTPException(status_code=400, detail="bad file")
+
+        job = manager.submit("upload", "digest", work)
+        await asyncio.sleep(0.01)
+        assert (job.status, job.error) == ("failed", "bad file")
+        assert job.duration is not None
+
+    asyncio.run(scenario())
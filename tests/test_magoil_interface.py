@@ -0,0 +1,105 @@
+import asyncio
+from datetime import date
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from components.interfaces import MagOilInterface
+from models.documents import MagOilReport
+
+REPORT = MagOilReport(start_date=date(2024, 2, 1), end_date=date(2024, 2, 29))
+
+
+class StandIn:
+    """Stand-in of the MagOil site: a session cookie per login, the export CSV behind it."""
+
+    def __init__(self, failures: int = 0, login_status: int = 200):
+        self.logins = 0
+        self.exports = 0
+        self.failures = failures
+        self.login_status = login_status
+        self.valid_session = None
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        # concurrent requests overlap as they would over the network
+        await asyncio.sleep(0.01)
+        if request.url.params.get("act") == "auth":
+            if self.login_status != 200:
+                return httpx.Response(self.login_status)
+            if "login" in request.url.params:
+                return httpx.Response(200, json={"auth_key": "key", "salt": "salt"})
+            self.logins += 1
+            self.valid_session = f"s{self.logins}"
+            return httpx.Response(200, json={}, headers={"set-cookie": f"session={self.valid_session}; Path=/"})
+        if self.failures:
+            self.failures -= 1
+            return httpx.Response(503)
+        if request.headers.get("cookie") != f"session={self.valid_session}":
+            return httpx.Response(401)
+        self.exports += 1
+        return httpx.Response(200, content="﻿Карта;Литры\n1;10.5\n2;\n".encode())
+
+    def expire(self):
+        self.valid_session = None
+
+
+def client(stand_in: StandIn) -> MagOilInterface:
+    interface = MagOilInterface(base_url="http://magoil.test", transport=httpx.MockTransport(stand_in))
+    interface.RETRY_DELAY = 0
+    return interface
+
+
+def test_login_is_reused():
+    async def scenario():
+        stand_in = StandIn()
+        interface = client(stand_in)
+        await asyncio.gather(*(interface.get_csv(REPORT) for _ in range(5)))
+        df = await interface.get_csv(REPORT)
+        await interface.close()
+        return stand_in, df
+
+    stand_in, df = asyncio.run(scenario())
+    assert (stand_in.logins, stand_in.exports) == (1, 6)
+    assert df.fillna("").to_dict(orient="records") == [{"Карта": 1, "Литры": 10.5}, {"Карта": 2, "Литры": ""}]
+
+
+def test_concurrent_rejections_log_in_once():
+    async def scenario():
+        stand_in = StandIn()
+        interface = client(stand_in)
+        await interface.get_csv(REPORT)
+        stand_in.expire()
+        await asyncio.gather(*(interface.get_csv(REPORT) for _ in range(5)))
+        await interface.close()
+        return stand_in
+
+    stand_in = asyncio.run(scenario())
+    assert (stand_in.logins, stand_in.exports) == (2, 6)
+
+
+def test_unavailable_site_is_retried_then_reported_as_502():
+    async def scenario(stand_in: StandIn):
+        interface = client(stand_in)
+        try:
+            return await interface.get_csv(REPORT)
+        finally:
+            await interface.close()
+
+    assert len(asyncio.run(scenario(StandIn(failures=2)))) == 2
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(scenario(StandIn(failures=10)))
+    assert e.value.status_code == 502
+
+
+def test_failed_login_is_reported_as_502():
+    async def scenario():
+        interface = client(StandIn(login_status=403))
+        try:
+            await interface.get_csv(REPORT)
+        finally:
+            await interface.close()
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(scenario())
+    assert e.value.status_code == 502
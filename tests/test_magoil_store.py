@@ -0,0 +1,77 @@
+import json
+import threading
+from datetime import date, timedelta
+
+from components.interfaces import MagOilStore
+from database.sql_handler import MagOilTable
+
+
+def replace_day(day: date, records) -> int:
+    with MagOilTable() as table:
+        table.create_tables()
+        return table.replace_day(day, records)
+
+
+def test_replace_day_keeps_only_the_last_load(cars_db):
+    day = date(2024, 2, 1)
+    assert replace_day(day, ['{"Карта": 1}', '{"Карта": 2}']) == 2
+    assert replace_day(day, ['{"Карта": 3}']) == 1
+    assert replace_day(date(2024, 2, 2), []) == 0
+    with MagOilTable() as table:
+        assert set(table.loaded_days(date(2024, 1, 31), date(2024, 2, 2))) == {day, date(2024, 2, 2)}
+        assert json.loads(table.get_days_json(day, date(2024, 2, 2))) == [{"Карта": 3}]
+        assert table.get_days_json(date(2024, 3, 1), date(2024, 3, 2)) == "[]"
+
+
+class MeetingMagOilTable(MagOilTable):
+    """Makes two loads meet after the partition is created, unless one of them waits for the other."""
+    barrier = threading.Barrier(2, timeout=1)
+
+    def partition(self, day: date):
+        partition = super().partition(day)
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        return partition
+
+
+def test_concurrent_loads_of_a_day(cars_db):
+    day, errors = date(2024, 2, 3), []
+    replace_day(day, [])
+
+    def load(card: int):
+        try:
+            with MeetingMagOilTable() as table:
+                table.replace_day(day, [json.dumps({"Карта": card})] * 100)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load, args=(card,)) for card in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    cars_db.execute("select count(*), count(distinct data::text) from magoil_transactions where day = %s", (day,))
+    assert cars_db.fetchall() == [(100, 1)]
+
+
+def test_drop_days_before(cars_db):
+    for day in (date(2024, 1, 30), date(2024, 1, 31), date(2024, 2, 1)):
+        replace_day(day, ['{"Карта": 1}'])
+    with MagOilTable() as table:
+        assert table.drop_days_before(date(2024, 2, 1)) == [date(2024, 1, 30), date(2024, 1, 31)]
+    with MagOilTable() as table:
+        assert list(table.loaded_days(date(2024, 1, 1), date(2024, 2, 29))) == [date(2024, 2, 1)]
+        assert table.drop_days_before(date(2024, 2, 1)) == []
+    cars_db.execute("select count(*) from pg_inherits where inhparent = 'magoil_transactions'::regclass")
+    assert cars_db.fetchone()[0] == 1
+
+
+def test_report_refetches_today(cars_db):
+    today, yesterday = date.today(), date.today() - timedelta(days=1)
+    replace_day(yesterday, [])
+    replace_day(today, [])
+    store = MagOilStore(None)
+    assert store.stale_days(yesterday, today, missing_only=True) == [today]
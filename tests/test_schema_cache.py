@@ -0,0 +1,15 @@
+import logging
+
+from database.sql_handler import DataBase, SchemaCache
+
+
+def test_prefetch_skips_an_unreachable_database(cars_db, caplog):
+    cars_db.execute("create table _reference1 (id serial primary key, _description text)")
+    # nothing listens on port 1
+    DataBase._credentials["db1c"] = dict(DataBase._credentials["cars"], port=1)
+    with caplog.at_level(logging.WARNING):
+        SchemaCache.prefetch(["_reference1", "_reference2", "_reference3"])
+    assert [record.getMessage().split(":")[0] for record in caplog.records] == [
+        "schema prefetch of Db1cTable skipped", "schema prefetch of _reference2 failed",
+        "schema prefetch of _reference3 failed"]
+    assert SchemaCache.get("cars", "_reference1", "primary_key", lambda: None) == ["id"]
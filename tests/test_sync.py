@@ -0,0 +1,59 @@
+from database.sql_handler import CarsTable
+from database.sync import SyncOrchestrator
+
+GROUPS = {"persons": ("_reference1", "_inforg1"), "cars": ("_reference2",), "invoices": ("_document3",)}
+
+
+def create_tables(db1c, cars_db):
+    """1C tables with a few rows and their empty copies; the cars copies of the reference tables have an id."""
+    for table in ("_reference1", "_reference2", "_document3"):
+        db1c.execute(f"create table {table} (_idrref int primary key, _version int, _description text);"
+                     f"insert into {table} select i, 1, 'row ' || i from generate_series(1, 3) i")
+        cars_db.execute(f"create table {table} (id serial unique, _idrref int primary key, _version int, "
+                        f"_description text)")
+    db1c.execute("create table _inforg1 (_fld int, _value text); insert into _inforg1 values (1, 'a'), (2, 'b')")
+    cars_db.execute("create table _inforg1 (_fld int, _value text)")
+
+
+def count(cur, table: str) -> int:
+    cur.execute(f"select count(*) from {table}")
+    return cur.fetchone()[0]
+
+
+def test_all_groups_on_a_fresh_db(db1c, cars_db):
+    create_tables(db1c, cars_db)
+    report = SyncOrchestrator(GROUPS).run()
+    assert {group: result["status"] for group, result in report.items()} == dict.fromkeys(GROUPS, "ok")
+    assert [count(cars_db, table) for table in ("_reference1", "_inforg1", "_reference2", "_document3")] == [3, 2, 3, 3]
+    cars_db.execute(f"select table_name from {CarsTable.SYNC_STATE_TABLE} order by table_name")
+    assert cars_db.fetchall() == [("_document3",), ("_reference1",), ("_reference2",)]
+
+
+def test_group_runs_after_its_dependencies(db1c, cars_db):
+    create_tables(db1c, cars_db)
+    report = SyncOrchestrator(GROUPS, {"invoices": ("cars",)}).run(["invoices"])
+    assert list(report) == ["cars", "invoices"]
+    assert all(result["status"] == "ok" for result in report.values())
+    assert count(cars_db, "_reference1") == 0
+
+
+def test_failed_group_skips_its_dependents(db1c, cars_db):
+    create_tables(db1c, cars_db)
+    # the 1C rows break a constraint of the cars copy, so its insert fails
+    cars_db.execute("alter table _reference2 add check (_version > 1)")
+    report = SyncOrchestrator(GROUPS, {"invoices": ("cars",)}).run()
+    assert report["persons"]["status"] == "ok"
+    assert report["cars"]["status"] == "error"
+    assert report["invoices"] == {"status": "skipped", "error": "dependency failed", "tables": {}}
+    assert count(cars_db, "_document3") == 0
+
+
+def test_failed_table_rolls_back_its_group(db1c, cars_db):
+    create_tables(db1c, cars_db)
+    cars_db.execute("alter table _inforg1 add check (_fld > 1)")
+    report = SyncOrchestrator(GROUPS).run(["persons"])
+    assert report["persons"]["status"] == "error"
+    # _reference1 was synced before _inforg1 failed, in the same transaction
+    assert count(cars_db, "_reference1") == 0
+    cars_db.execute(f"select count(*) from {CarsTable.SYNC_STATE_TABLE} where table_name = '_reference1'")
+    assert cars_db.fetchone()[0] == 0